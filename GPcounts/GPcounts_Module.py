@@ -1,20 +1,27 @@
 import os 
+import io
+import time
+import csv
+import json
+import hashlib
+import multiprocessing
+import concurrent.futures
 import numpy as np
 import tensorflow as tf
 import gpflow
-from GPcounts import branchingKernel
-from GPcounts import NegativeBinomialLikelihood
-from sklearn.cluster import KMeans
-import scipy.stats as ss
+from GPcounts import batchedGP
+from GPcounts import kernelCache
+from GPcounts import modelStore
+from GPcounts import countsReader
+from GPcounts import inducingPoints
+from GPcounts import geneFit
 from pathlib import Path
 import pandas as pd
-from gpflow.utilities import set_trainable
 from tqdm import tqdm
-from scipy.signal import savgol_filter
 import random
-from .utilities import qvalue
-import scipy as sp
-from scipy import interpolate
+from collections import deque
+from .utilities import qvalue, calculate_FDR, fingerprint
+import scipy.sparse
 
 # Get number of cores reserved by the batch system (NSLOTS is automatically set, or use 1 if not)
 NUMCORES=int(os.getenv("NSLOTS",1))
@@ -24,51 +31,89 @@ config=tf.compat.v1.ConfigProto(inter_op_parallelism_threads=NUMCORES,intra_op_p
 tf.compat.v1.Session.intra_op_parallelism_threads = NUMCORES
 tf.compat.v1.Session.inter_op_parallelism_threads = NUMCORES
 
+# copy of the Fit_GPcounts object owned by a worker process, set once per worker by _init_worker
+_worker_gp = None
+
+def _init_worker(gp):
+    global _worker_gp
+    _worker_gp = gp
+    _worker_gp.progress_bar = False
+    _worker_gp.worker = True
+
+def _run_worker(method_name,args):
+    return getattr(_worker_gp,method_name)(*args)
+
 class Fit_GPcounts(object):
     
-    def __init__(self,X = None,Y= None,scale = None,sparse = False,nb_scaled=False,safe_mode = False):
+    def __init__(self,X = None,Y= None,scale = None,sparse = False,nb_scaled=False,safe_mode = False,warm_start = None,
+                 save_models = 'checkpoint',compiled_fit = False,zero_split = False):
      
         self.safe_mode = safe_mode
         self.folder_name = 'GPcounts_models/'
         self.transform = True # to use log(count+1) transformation
         self.sparse = sparse # use sparse or full inference 
+        self.inducing_points = 'kmeans' # inducing points selection: 'kmeans', 'minibatch_kmeans', 'quantile' or 'greedy_variance'
+        self.max_inducing_points = None # cap on the number of inducing points, None for 5% of the cells
+        self.inducing_points_cache = {} # inducing points keyed by inputs, number of points and selection method
+        self.minibatch_size = None # cells per mini-batch to train sparse non Gaussian models stochastically, None for full data L-BFGS
+        # stochastic training: maximum number of updates, Adam learning rate of the hyper-parameters, natural gradient step of the 
+        # variational parameters, updates averaged per convergence check and relative change of the averaged loss to stop
+        self.minibatch_options = {'maxiter':20000,'learning_rate':0.01,'gamma':0.1,'window':100,'tolerance':1e-4}
         self.nb_scaled = nb_scaled
         self.X = None # time points == cell or samples 
         self.M = None # number of inducing point
         self.Z = None # inducing points
         self.Y = None # gene expression matrix
         self.Y_copy = None #copy of gene expression matrix
+        self.reader = None # CountsReader when Y is read from a file, genes are then loaded chunk by chunk
+        self.Y_offset = 0 # index of the first gene held in Y
+        self.samples = None # inputs, inducing points and cells of the samples of the two samples test
+        self.samples_key = None # sparse, inducing points selection and cap the samples were set with
+        self.sparse_counts = False # Y is kept as a scipy.sparse CSR matrix
+        self.zero_split = zero_split # evaluate NB and ZINB zero counts terms only on zero counts, faster on sparse counts
         self.D =  None # number of genes
         self.N = None # number of cells
         self.scale = scale
         self.genes_name = None
         self.cells_name = None  
-        self.Scale = None
         
         # test information
         self.lik_name = None # the selected likelihood name 
         self.models_number = None # Total number of models to fit for single gene for selected test
-        self.model_index = None # index the current model 
-        self.hyper_parameters = {} # model paramaters initialization
         self.user_hyper_parameters = [None,None,None,None]# user model paramaters initialization
-        self.model = None # GP model information    
-        self.var = None # GP variance of posterior predictive
-        self.mean = None # GP mean of posterior predictive
-        self.fix = False # fix hyper-parameters
-
-        # save likelihood of hyper-parameters of dynamic model to initialize the constant model
-        self.lik_alpha = None  
-        self.lik_km = None
-        self.optimize = True  # optimize or load model
+        self.model = None # latest fitted or restored GP model
+        self.fix = False # fix hyper-parameters of the branching kernel
+
         self.branching = None # DE kernel or RBF kernel
         self.xp = -1000. # Put branching time much earlier than zero time
+        self.MAP_bin = None # log posterior, branching time and model of the best branching bin during the search
+        self.warm_start = warm_start # None, 'median' or 'nearest' to initialize genes from hyper-parameters of converged genes
+        self.warm_start_window = 500 # number of latest converged genes kept per model to build the warm start
+        self.fitted_hyper_parameters = {} # features and hyper-parameters of converged genes per model index
         
-        # single gene information  
-        self.y = None
-        self.index = None
-        self.global_seed = 0
-        self.seed_value = 0 # initialize seed 
-        self.count_fix = 0 # counter of number of trails to resolve either local optima or failure duo to numerical issues
+        self.global_seed = 0 # seed of the first fit of every model, random restarts add one per restart
+        self.seed_value = 0 # seed of the latest model, used to sample its posterior predictive distribution
+        self.restarts = 0 # total number of random restarts of all fitted models
+        self.profile = False # record time, iterations and restarts of every fitted model, see profile_report
+        self.profile_hooks = [] # callables hook(event,record) called with 'start' and 'end' around the fit of every model
+        self.profile_records = [] # records of the models fitted by the latest test
+        self.profile_record = None # record of the model being fitted
+        self.f_samples_number = 100 # number of latent GP samples drawn for the posterior predictive distribution
+        self.y_samples_number = 500 # number of counts sampled per test point and round of five latent samples
+        self.progress_bar = True # show tqdm progress bar over genes
+        self.local_optima_check = 'sampling' # safe mode check of the predictive mean from posterior predictive 'sampling' or 'analytic', faster
+        self.batched_models = {} # compiled batched GPs keyed by input, likelihood and kernel 
+        self.batched_refits = 0 # genes whose batched fit did not converge and were refitted one by one
+        self.kernel_cache = None # kernelCache.KernelCache to share kernel matrices between genes with the same inputs, None for plain GPflow models
+        self.save_models = save_models # 'checkpoint' one checkpoint per model, 'store' one file per test or None 
+        self.model_store = None # parameters of the models fitted by the running test when save_models is 'store'
+        self.worker = False # True in worker processes, which return their models to the parent instead of saving them
+        self.journal = None # CSV file where the results of every gene are appended, a rerun skips the genes it holds
+        self.journal_file = None # journal of the running test, None when results are not journaled
+        self.journal_genes = set() # genes of the running test already in the journal
+        self.compiled_fit = compiled_fit # reuse one compiled model per inputs, kernel and likelihood across genes
+        self.compiled_models = {} # CompiledModel keyed by inputs, inducing points, likelihood and kernel
+        self.minibatch_models = {} # CompiledMinibatchModel keyed by numbers of cells and inducing points, likelihood and kernel
         
         # check the X and Y are not missing
         if (X is None) or (Y is None):
@@ -80,6 +125,10 @@ class Fit_GPcounts(object):
         self.seed_value = 0
         np.random.seed(self.seed_value)
         
+        # Y is a DataFrame (dense or sparse), a scipy.sparse matrix, a counts file path or a CountsReader
+        if isinstance(Y,(str,Path)):
+            Y = countsReader.CountsReader(Y)
+        
         if X.shape[0] == Y.shape[1]:
             self.X = X
             self.cells_name = self.X.index.values
@@ -91,59 +140,126 @@ class Fit_GPcounts(object):
                 self.X = self.X.reshape([-1, 1])
             
             if self.sparse:
-                self.M = int((5*(len(self.X)))/100) # number of inducing points is 5% of length of time points 
-                # set inducing points by K-mean cluster algorithm
-                kmeans = KMeans(n_clusters= self.M).fit(self.X)
-                self.Z = kmeans.cluster_centers_
-                self.Z = np.sort(self.Z,axis=None).reshape([self.M,1])
-                self.Z = self.Z.reshape([self.Z.shape[0],1])
+                self.Z = self.get_inducing_points(self.X)
+                self.M = self.Z.shape[0]
               
-            self.Y = Y
-            self.genes_name = self.Y.index.values.tolist() # gene expression name
-            
-            if self.lik_name == 'Gaussian':
-                self.Y = self.Y.values # gene expression matrix
+            if isinstance(Y,countsReader.CountsReader):
+                self.reader = Y
+                self.genes_name = list(Y.genes_name)
+                self.Y = None # loaded by gene_counts
+                self.sparse_counts = Y.format == 'sparse'
             else:
-                self.Y = self.Y.values.astype(int)
-                self.Y = self.Y.astype(float)
+                self.reader = None
+                if isinstance(Y,pd.DataFrame):
+                    self.genes_name = Y.index.values.tolist() # gene expression name
+                else: # scipy.sparse matrix
+                    self.genes_name = ['gene_%d' %i for i in range(Y.shape[0])]
+                
+                self.sparse_counts = scipy.sparse.issparse(Y) or (isinstance(Y,pd.DataFrame) and len(Y.columns) > 0 and 
+                                                                   all(isinstance(dtype,pd.SparseDtype) for dtype in Y.dtypes))
+                self.Y = Y
+                if self.sparse_counts:
+                    # zeros are not stored, genes are densified one at a time by gene_counts 
+                    if isinstance(Y,pd.DataFrame):
+                        Y = Y.sparse.to_coo()
+                    self.Y = scipy.sparse.csr_matrix(Y).astype(float)
+                    if self.lik_name != 'Gaussian':
+                        np.trunc(self.Y.data,out = self.Y.data)
+                elif self.lik_name == 'Gaussian':
+                    self.Y = self.Y.values # gene expression matrix
+                else:
+                    # truncate counts to integers in the float copy 
+                    self.Y = self.Y.values.astype(float)
+                    np.trunc(self.Y,out = self.Y)
                 
+            self.Y_offset = 0
             self.Y_copy = self.Y
             self.D = Y.shape[0] # number of genes
             self.N = Y.shape[1] # number of cells
+            self.samples = None
         else:
             print('InvalidArgumentError: Dimension 0 in X shape must be equal to Dimension 1 in Y, but shapes are %d and %d.' %(X.shape[0],Y.shape[1]))
-        
     
-    def Infer_trajectory(self,lik_name= 'Negative_binomial',transform = True): 
+    # inducing points are selected once per inputs and reused, e.g. by the samples of the two samples test
+    def get_inducing_points(self,X):
+        M = max(1,int((5*(len(X)))/100)) # number of inducing points is 5% of length of time points 
+        if self.max_inducing_points is not None:
+            M = min(M,self.max_inducing_points)
+        key = (fingerprint(X),M,self.inducing_points)
+        if key not in self.inducing_points_cache:
+            self.inducing_points_cache[key] = inducingPoints.select_inducing_points(X,M,self.inducing_points)
+        return self.inducing_points_cache[key]
+    
+    # inputs, inducing points and cells of all cells and of the two samples of the two samples test, set once per test 
+    def set_samples(self):
+        key = (self.sparse,self.inducing_points,self.max_inducing_points)
+        if self.samples is None or self.samples_key != key:
+            self.samples_key = key
+            X = self.X
+            half = int(self.N/2)
+            self.samples = []
+            for cells in [slice(None),slice(0,half),slice(half,None)]:
+                self.seed_value = 0
+                np.random.seed(self.seed_value)
+                Z = self.get_inducing_points(X[cells]) if self.sparse else None
+                self.samples.append({'X':X[cells],'Z':Z,'cells':cells,'N':len(X[cells])})
+    
+    # inputs, inducing points and cells of the data of every model of a gene
+    def models_data(self):
+        if self.models_number == 3: # all cells, first and second time series
+            return [(sample['X'],sample['Z'],sample['cells']) for sample in self.samples]
+        Z = self.Z if self.sparse else None
+        return [(self.X,Z,slice(None))]*self.models_number
+    
+    
+    def __getstate__(self):
+        # fitted GPflow models hold TensorFlow state and are not sent to worker processes
+        state = self.__dict__.copy()
+        state['model'] = None
+        state['batched_models'] = {}
+        state['compiled_models'] = {}
+        state['minibatch_models'] = {}
+        state['profile_hooks'] = [] # hooks stay in the parent process, workers return their profile records
+        if self.reader is not None: # workers read their own chunks
+            state['Y'] = None
+        if self.kernel_cache is not None:
+            state['kernel_cache'] = kernelCache.KernelCache(self.kernel_cache.max_bytes)
+        return state
+    
+    def Infer_trajectory(self,lik_name= 'Negative_binomial',transform = True,n_jobs = 1,batch_size = None): 
         
         genes_index = range(self.D)
-        genes_results = self.run_test(lik_name,1,genes_index)
+        genes_results = self.run_test(lik_name,1,genes_index,n_jobs = n_jobs,batch_size = batch_size)
         
         return genes_results
         
-    def One_sample_test(self,lik_name= 'Negative_binomial', transform = True):
+    def One_sample_test(self,lik_name= 'Negative_binomial', transform = True,n_jobs = 1,batch_size = None):
         
         genes_index = range(self.D)
-        genes_results = self.run_test(lik_name,2,genes_index)
+        genes_results = self.run_test(lik_name,2,genes_index,n_jobs = n_jobs,batch_size = batch_size)
         genes_results['log_likelihood_ratio'] = genes_results['log_likelihood_ratio'].clip(lower=0)
         genes_results['log_likelihood_ratio'] = genes_results['log_likelihood_ratio'].fillna(0)
         #if self.nb_scaled:
            
         return genes_results
         
-    def Two_samples_test(self,lik_name= 'Negative_binomial',transform = True):
+    def Two_samples_test(self,lik_name= 'Negative_binomial',transform = True,n_jobs = 1,batch_size = None):
         
         genes_index = range(self.D)
-        genes_results = self.run_test(lik_name,3,genes_index)
+        genes_results = self.run_test(lik_name,3,genes_index,n_jobs = n_jobs,batch_size = batch_size)
         
         return genes_results
 
     def Infer_branching_location(self, cell_labels, bins_num=50, lik_name='Negative_binomial',
-                                               branching_point=-1000):
+                                               branching_point=-1000, n_jobs=1, search='grid', tolerance=None):
+        if bins_num < 2: # the last bin stands for no branching
+            raise ValueError('bins_num must be at least 2, got %d' % bins_num)
         cell_labels = np.array(cell_labels)
         self.X = np.c_[self.X, cell_labels[:, None]]
         self.branching = True
+        self.fix = False
         self.xp = branching_point
+        self.profile_records = []
         # return self.X
         genes_index = range(self.D)
         log_likelihood = self.run_test(lik_name, 1, genes_index, branching=True)
@@ -152,62 +268,61 @@ class Fit_GPcounts(object):
         self.branching_kernel_ls = self.model.kernel.kern.lengthscales.numpy()
 
         # return log_likelihood
-        return self.infer_branching(lik_name, bins_num)
+        return self.infer_branching(lik_name, bins_num, n_jobs, search, tolerance)
 
-    def infer_branching(self, lik_name, bins_num):
-        testTimes = np.linspace(min(self.X[:, 0]), max(self.X[:, 0]), bins_num, endpoint=True)
-        ll = np.zeros(bins_num)
-        models = list()
-        genes_index = range(self.D)
+    def infer_branching(self, lik_name, bins_num, n_jobs=1, search='grid', tolerance=None):
+        '''
+        :param search: 'grid' to fit bins_num evenly spaced branching times or 'adaptive' to refine a coarse grid
+        :param tolerance: resolution of the adaptive search, the spacing of the bins_num grid if None
+        '''
         self.fix = True
         X = self.X
-        for i in range(0, bins_num):
-            del self.X
-            # gpflow.utilities.print_summary(self.model, fmt='notebook')
-            del self.model
-
-            self.xp = testTimes[i]
-            self.X = X.copy()
-            self.X[np.where(self.X[:, 0] <= testTimes[i]), 1] = 1
+        self.MAP_bin = None
 
-            _ = self.run_test(lik_name, 1, genes_index, branching=True)
-            ll[i] = self.model.log_posterior_density().numpy()
-            models.append(self.model)
-        del self.model
+        if search == 'adaptive':
+            testTimes, log_ll, weights = self.adaptive_branching_search(lik_name, X, bins_num, n_jobs, tolerance)
+        else:
+            testTimes = np.linspace(min(self.X[:, 0]), max(self.X[:, 0]), bins_num, endpoint=True)
+            log_ll = np.array(self.fit_branching_bins(lik_name, X, testTimes, n_jobs))
+            weights = None
 
         # Find MAP model
-        log_ll = np.zeros(bins_num)
-        i = 0
-        for mm in models:
-            log_ll[i] = mm.log_posterior_density().numpy()
-            i = i + 1
-        p = self.CalculateBranchingEvidence({'loglik': log_ll}, testTimes)
+        p = self.CalculateBranchingEvidence({'loglik': log_ll}, testTimes, weights)
         ll = p['posteriorBranching']
         # tmp = -500. - max(log_ll)
         # for i in range(0, bins_num):
         #     ll[i] = np.exp(log_ll[i] + tmp)
         # normalized_ll = ll / ll.sum(0)
 
-        iMAP = np.argmax(ll)
-        # MAP_model = models[iMAP]
-        self.model = models[iMAP]
+        # on the adaptive grid ll is the probability of the interval of every point, the MAP is the highest density
+        iMAP = np.argmax(ll) if weights is None else np.argmax(log_ll)
+        if self.MAP_bin is None or self.MAP_bin[1] != testTimes[iMAP]: # workers only return log posteriors
+            self.fit_branching_bin(lik_name, X, testTimes[iMAP])
+        else:
+            self.model = self.MAP_bin[2]
+        self.MAP_bin = None
+        # the bins are not saved, only the MAP model
+        if isinstance(self.model, gpflow.models.GPModel):
+            self.save_model(self.D - 1, 1, self.model)
+            self.save_model_store()
+        self.X = X.copy()
+        self.X[np.where(self.X[:, 0] <= testTimes[iMAP]), 1] = 1
         # Prediction
         Xnew = np.linspace(min(self.X[:,0]), max(self.X[:,0]), 100).reshape(-1)[:, None]
         x1 = np.c_[Xnew, np.ones(len(Xnew))[:, None]]
         x2 = np.c_[Xnew, (np.ones(len(Xnew)) * 2)[:, None]]
         Xtest = np.concatenate((x1, x2))
-        Xtest[np.where(Xtest[:, 0] <= self.model.kernel.xp), 1] = 1
+        Xtest[np.where(Xtest[:, 0] <= self.model.kernel.xp.numpy()), 1] = 1
 
         if self.lik_name == 'Gaussian':
             mu, var = self.model.predict_y(Xtest)
         else:
             mu, var = self.samples_posterior_predictive_distribution(Xtest)
 
-        del models
         self.branching = False
         return {'geneName':self.genes_name,
                 'branching_probability':ll,
-                'branching_location':self.model.kernel.xp,
+                'branching_location':self.model.kernel.xp.numpy(),
                 'mean': mu,
                 'variance':var,
                 'Xnew':Xnew,
@@ -217,10 +332,81 @@ class Fit_GPcounts(object):
                 'logBayesFactor':p['logBayesFactor'],
                 'likelihood':self.lik_name}
 
-    def CalculateBranchingEvidence(self, d, Bsearch):
+    def fit_branching_bins(self, lik_name, X, times, n_jobs=1):
+        '''
+        :param times: candidate branching times
+        :return: log posterior density of every candidate, the best model fitted in this process is kept in MAP_bin
+        '''
+        if n_jobs > 1:
+            return list(self.run_parallel('fit_branching_bin', [(lik_name, X, xp) for xp in times], n_jobs))
+
+        log_ll = []
+        for xp in times:
+            log_ll.append(self.fit_branching_bin(lik_name, X, xp))
+            if self.MAP_bin is None or log_ll[-1] > self.MAP_bin[0]:
+                self.MAP_bin = (log_ll[-1], xp, self.model)
+        return log_ll
+
+    def adaptive_branching_search(self, lik_name, X, bins_num, n_jobs, tolerance):
+        '''
+        Fit a coarse grid of branching times, then bisect the two intervals next to the highest posterior candidate
+        until they are narrower than tolerance. At most bins_num branching times are fitted in total.
+        :return: sorted candidate times, their log posterior and the width of the interval each one stands for
+        '''
+        t_min, t_max = min(X[:, 0]), max(X[:, 0])
+        if tolerance is None:
+            tolerance = (t_max - t_min) / (bins_num - 1)
+        # half of the budget for the coarse grid, the rest for bisection
+        coarse = np.linspace(t_min, t_max, max(2, min(bins_num // 2, 10)), endpoint=True)
+
+        testTimes = list(coarse)
+        log_ll = self.fit_branching_bins(lik_name, X, coarse, n_jobs)
+        while True:
+            order = np.argsort(testTimes)
+            times = np.array(testTimes)[order]
+            lls = np.array(log_ll)[order]
+            if np.all(np.isnan(lls)):
+                break
+
+            i = np.nanargmax(lls)
+            new_times = [(times[i] + times[j]) / 2. for j in [i - 1, i + 1]
+                         if 0 <= j < len(times) and abs(times[j] - times[i]) > tolerance]
+            new_times = new_times[0:bins_num - len(testTimes)]
+            if not new_times:
+                break
+            testTimes += new_times
+            log_ll += self.fit_branching_bins(lik_name, X, new_times, n_jobs)
+
+        # the last time stands for no branching and keeps the coarse spacing
+        weights = np.append(np.diff(times), coarse[1] - coarse[0])
+        return times, lls, weights
+
+    def fit_branching_bin(self, lik_name, X, xp):
+        '''
+        :param X: times and cell labels
+        :param xp: candidate branching time
+        :return: log posterior density of the branching GP with branching time xp
+        '''
+        self.xp = xp
+        self.X = X.copy()
+        self.X[np.where(self.X[:, 0] <= xp), 1] = 1
+
+        # the model files have no bin in their name, worker processes would write the same files at once
+        save_models = self.save_models
+        self.save_models = None
+        try:
+            _ = self.run_test(lik_name, 1, range(self.D), branching=True)
+        finally:
+            self.save_models = save_models
+        if not isinstance(self.model, gpflow.models.GPModel): # fit failed
+            return np.nan
+        return self.model.log_posterior_density().numpy()
+
+    def CalculateBranchingEvidence(self, d, Bsearch, weights=None):
         """
         :param d: output dictionary from FitModel
         :param Bsearch: candidate list of branching points
+        :param weights: width of the interval each point stands for when the points are not evenly spaced
         :return: posterior probability of branching at each point and log Bayes factor
         of branching vs not branching
         """
@@ -228,6 +414,8 @@ class Fit_GPcounts(object):
         # o = d['loglik'][:-1]
         o = d['loglik']
         pn = np.exp(o - np.max(o))
+        if weights is not None:
+            pn = pn * weights
         p = pn / pn.sum()  # normalize
 
         # Calculate log likelihood ratio by averaging out
@@ -238,25 +426,31 @@ class Fit_GPcounts(object):
         obj = o[:-1]
         illmax = np.argmax(obj)
         llmax = obj[illmax]
-        lratiostable = llmax + np.log(1 + np.exp(obj[np.arange(obj.size) != illmax] - llmax).sum()) - o[-1] - np.log(Nb)
+        if weights is None:
+            lratiostable = llmax + np.log(1 + np.exp(obj[np.arange(obj.size) != illmax] - llmax).sum()) - o[-1] - np.log(Nb)
+        else: # average over the branching points weighted by their intervals
+            w = weights[:-1] / weights[:-1].sum()
+            lratiostable = llmax + np.log((w * np.exp(obj - llmax)).sum()) - o[-1]
 
         return {'posteriorBranching': p, 'logBayesFactor': lratiostable}
      
         
     def calculate_FDR(self,genes_results):
-        genes_results['p value'] = 1 - ss.chi2.cdf(genes_results['log_likelihood_ratio'], df=1)
-        genes_results['q value']= self.qvalue(genes_results['p value'])
-        
-        return genes_results
+        # genes_results can also be a list or dict of results tables, see utilities.calculate_FDR
+        return calculate_FDR(genes_results)
     
     # Run the selected test and get likelihoods for all genes   
-    def run_test(self,lik_name,models_number,genes_index,branching = False):
+    def run_test(self,lik_name,models_number,genes_index,branching = False,n_jobs = 1,batch_size = None):
         
         genes_results = {}
         self.Y = self.Y_copy
         self.models_number = models_number
         self.lik_name = lik_name
-        self.optimize = True
+        self.model_store = modelStore.ModelStore(self.get_store_name()) if self.save_models == 'store' else None
+        if not branching: # the branching search keeps the records of all its runs
+            self.profile_records = []
+        if models_number == 3:
+            self.set_samples()
         
         #column names for likelihood dataframe
         if self.models_number == 1:
@@ -266,68 +460,285 @@ class Fit_GPcounts(object):
         else:
             column_name = ['Shared_log_likelihood','model_1_log_likelihood','model_2_log_likelihood','log_likelihood_ratio'] 
         
-        for self.index in tqdm(genes_index):
-          
-            self.y = self.Y[self.index].astype(float)
-            self.y = self.y.reshape([-1,1])
-            results = self.fit_single_gene(column_name)
-            genes_results[self.genes_name[self.index]] = results
+        # genes finished by an interrupted run are read from the journal and skipped, shards and blocks are
+        # still cut from all genes so the other genes are fitted as in an uninterrupted run.
+        # branching runs fit the same genes for every branching point and are not journaled.
+        # workers keep the journal prepared by the parent and only append to it
+        journal_results = None
+        if not self.worker:
+            self.journal_file = None
+            self.journal_genes = set()
+            if self.journal is not None and not branching:
+                journal_results = self.read_journal(column_name)
+                if journal_results is not None:
+                    self.journal_file = self.journal
+                    self.journal_genes = set(journal_results.index)
+        remaining = [index for index in genes_index if self.genes_name[index] not in self.journal_genes]
+        
+        if batch_size is not None and (self.sparse or branching or self.nb_scaled or self.safe_mode):
+            print('Batched fitting supports full GPs without scaling or safe mode, genes are fitted one by one.')
+            batch_size = None
+        
+        if n_jobs > 1 and len(remaining) > 1:
+            # shard genes across worker processes, every gene is still fitted with its own seeds 
+            shards = np.array_split(np.asarray(genes_index),min(len(genes_index),4*n_jobs))
+            tasks = [(lik_name,models_number,shard.tolist(),branching,1,batch_size) for shard in shards]
+            # warm starts depend on the genes fitted before, which would depend on the shards 
+            warm_start = self.warm_start
+            if warm_start is not None:
+                print('Warm start follows the genes fitted one after the other, genes fitted by n_jobs workers start '
+                      'from the default initialization.')
+                self.warm_start = None
+            try:
+                results = self.run_parallel('run_test_shard',tasks,n_jobs)
+            finally:
+                self.warm_start = warm_start
+            if self.model_store is not None:
+                for _,models,_,_,_ in results:
+                    self.model_store.update(models)
+            self.restarts += sum(restarts for _,_,restarts,_,_ in results)
+            self.batched_refits += sum(refits for _,_,_,_,refits in results)
+            self.profile_records += [record for _,_,_,records,_ in results for record in records]
+            genes_results = pd.concat([shard_results for shard_results,_,_,_,_ in results])
+        
+        elif batch_size is not None:
+            genes_results = self.run_test_batched(column_name,genes_index,batch_size)
+        
+        else:
+            for index in tqdm(remaining,disable = not self.progress_bar):
+              
+                results = self.fit_single_gene(index)
+                genes_results[self.genes_name[index]] = results
+                self.append_journal([(self.genes_name[index],results)])
+            genes_results = pd.DataFrame.from_dict(genes_results, orient='index', columns= column_name)
 
+        self.save_model_store()
+        if journal_results is not None and not self.worker: # workers return only the genes they fitted
+            genes_order = [self.genes_name[index] for index in genes_index]
+            genes_results = pd.concat([journal_results,genes_results.astype(float)]).loc[genes_order]
+        return genes_results
+    
+    def read_journal(self,column_name):
+        """
+        Create the journal or repair the journal of an interrupted run, called once by the parent before any worker starts
+        :param column_name: columns of the running test
+        :return: results of the genes in the journal, None if the journal was written by another test, likelihood, 
+        settings or data
+        """
+        settings = '#'+json.dumps(self.journal_settings(),sort_keys = True)+'\n'
+        if not os.path.exists(self.journal) or os.path.getsize(self.journal) == 0:
+            with open(self.journal,'w') as f:
+                f.write(settings+self.journal_line('gene',column_name))
+            return pd.DataFrame(columns = column_name,dtype = float)
+        
+        with open(self.journal,'rb+') as f:
+            content = f.read()
+            if not content.startswith(settings.encode()):
+                print('The journal %s was written by another test, likelihood, settings or data, genes results are not '
+                      'resumed from it or journaled.' %self.journal)
+                return None
+            # drop the last row if the run was interrupted while writing it
+            if not content.endswith(b'\n'):
+                f.truncate(content.rfind(b'\n')+1)
+        
+        journal_results = pd.read_csv(self.journal,skiprows = 1,dtype = {'gene':str},
+                                      float_precision = 'round_trip').set_index('gene')
+        if list(journal_results.columns) != column_name:
+            print('The journal %s holds the results of another test, genes results are not journaled.' %self.journal)
+            return None
+        journal_results = journal_results[~journal_results.index.duplicated(keep = 'last')].astype(float)
+        journal_results.index.name = None
+        return journal_results
+    
+    # test, likelihood, settings changing the results and fingerprint of the inputs and counts, written in the first line 
+    # of the journal 
+    def journal_settings(self):
+        data = hashlib.sha1((fingerprint(self.X)+'\n'.join(self.genes_name)).encode())
+        for index in range(self.D):
+            data.update(np.ascontiguousarray(self.gene_counts(index),dtype = float).tobytes())
+        tests = {1:'Infer_trajectory',2:'One_sample_test',3:'Two_samples_test'}
+        return {'test':tests[self.models_number],'likelihood':self.lik_name,'sparse':self.sparse,
+                'inducing_points':self.inducing_points if self.sparse else None,
+                'max_inducing_points':self.max_inducing_points if self.sparse else None,
+                'transform':self.transform,'nb_scaled':self.nb_scaled,'safe_mode':self.safe_mode,'data':data.hexdigest()}
+    
+    def journal_line(self,gene,values):
+        line = io.StringIO()
+        # repr keeps every digit so resumed results are identical to an uninterrupted run
+        csv.writer(line,lineterminator = '\n').writerow([gene]+[value if isinstance(value,str) else repr(float(value)) 
+                                                                  for value in values])
+        return line.getvalue()
+    
+    # append the results of finished genes to the journal in one write, so worker processes can share the file, 
+    # after their models so that a resumed run can load the models of every journaled gene
+    def append_journal(self,genes_results):
+        if self.journal_file is not None:
+            if self.model_store is not None:
+                self.model_store.flush()
+            with open(self.journal_file,'a') as f:
+                f.write(''.join(self.journal_line(gene,results) for gene,results in genes_results))
+    
+    # run_test in a worker process, the fitted models, the number of restarts and the profile records are returned with 
+    # the results to the parent
+    def run_test_shard(self,*args):
+        restarts,refits = self.restarts,self.batched_refits
+        genes_results = self.run_test(*args)
+        models = {} if self.model_store is None else self.model_store.models
+        return genes_results,models,self.restarts-restarts,self.profile_records,self.batched_refits-refits
+    
+    def save_model_store(self):
+        if self.model_store is not None and not self.worker:
+            self.model_store.save()
+    
+    # fit blocks of genes that share X in one TensorFlow graph
+    def run_test_batched(self,column_name,genes_index,batch_size):
+        
+        genes_results = {}
+        genes_index = list(genes_index)
+        refits = self.batched_refits
+        
+        for start in tqdm(range(0,len(genes_index),batch_size),disable = not self.progress_bar):
+            block = [index for index in genes_index[start:start+batch_size] if self.genes_name[index] not in self.journal_genes]
+            if not block:
+                continue
+            results = self.fit_genes_batch(column_name,block)
+            for index,gene_results in zip(block,results):
+                genes_results[self.genes_name[index]] = gene_results
+            self.append_journal([(self.genes_name[index],gene_results) for index,gene_results in zip(block,results)])
+        
+        refits = self.batched_refits-refits
+        if refits > 0:
+            print('Batched fits of %d genes of %d did not converge, they were refitted one by one.' %(refits,len(genes_index)))
+                
         return pd.DataFrame.from_dict(genes_results, orient='index', columns= column_name)
     
-    # fit numbers of GPs = models_number to run the selected test
-    def fit_single_gene(self,column_name,reset =False):
-        if self.models_number == 1:
-            col_name = 0
+    # fit numbers of models = models_number for a block of genes, genes that do not converge are refitted one by one 
+    def fit_genes_batch(self,column_name,block):
+        
+        Y = np.vstack([self.gene_counts(index) for index in block]).astype(float)
+        model_1_log_likelihood,params,converged = self.fit_batched_model(self.X,Y)
+        results = [[model_1_log_likelihood[i]] for i in range(len(block))]
+        fitted_models = [(self.X,Y,params)]
+        
+        if self.models_number == 2:
+            # initialize the constant model with the dispersion of the dynamic model as fit_single_gene does
+            alpha = params.get('alpha') if self.lik_name == 'Negative_binomial' else None
+            model_2_log_likelihood,params_2,converged_2 = self.fit_batched_model(self.X,Y,constant = True,alpha = alpha)
+            converged = converged & converged_2
+            fitted_models.append((self.X,Y,params_2))
+            ll_ratio = model_1_log_likelihood - model_2_log_likelihood
+            results = [[model_1_log_likelihood[i],model_2_log_likelihood[i],ll_ratio[i]] for i in range(len(block))]
+            
+        if self.models_number == 3:
+            half = int(self.N/2)
+            model_2_log_likelihood,params_2,converged_2 = self.fit_batched_model(self.X[0:half],Y[:,0:half])
+            model_3_log_likelihood,params_3,converged_3 = self.fit_batched_model(self.X[half::],Y[:,half::])
+            converged = converged & converged_2 & converged_3
+            fitted_models += [(self.X[0:half],Y[:,0:half],params_2),(self.X[half::],Y[:,half::],params_3)]
+            ll_ratio = ((model_2_log_likelihood+model_3_log_likelihood)-model_1_log_likelihood)
+            results = [[model_1_log_likelihood[i],model_2_log_likelihood[i],model_3_log_likelihood[i],ll_ratio[i]] 
+                       for i in range(len(block))]
+        
+        self.save_batched_models(block,converged,fitted_models)
+        
+        for i in np.where(~converged[0:len(block)])[0]:
+            results[i] = self.fit_single_gene(block[i])
+            self.batched_refits += 1
+            
+        return results
+    
+    # save the models of converged genes of a block, fitted_models holds inputs, counts and parameters per model index
+    def save_batched_models(self,block,converged,fitted_models):
+        
+        for i in np.where(converged[0:len(block)])[0]:
+            index = block[i]
+            for model_index,(X,Y,params) in enumerate(fitted_models,1):
+                values = batchedGP.gpflow_parameters(params,i)
+                if self.save_models == 'store':
+                    self.model_store.models[self.get_model_key(index,model_index)] = values
+                elif self.save_models == 'checkpoint':
+                    self.save_model(index,model_index,self.restore_model(X,Y[i].reshape([-1,1]),params = values,index = index))
+    
+    def fit_batched_model(self,X,Y,constant = False,alpha = None):
+        
+        key = (X.tobytes(),X.shape,self.lik_name,constant)
+        if key not in self.batched_models:
+            self.batched_models[key] = batchedGP.BatchedGP(X,self.lik_name,constant_kernel = constant)
+        model = self.batched_models[key]
+        
+        # per gene version of initialize_hyper_parameters 
+        length_scale,variance,user_alpha,km = self.user_hyper_parameters
+        if length_scale is None:
+            length_scale = (5*(np.max(X)-np.min(X)))/100
+        if variance is None:
+            if self.lik_name == 'Gaussian' and not self.transform:
+                variance = np.mean(Y+1**2,axis = 1)
+            else:
+                variance = np.mean(np.log(Y+1)**2,axis = 1)
         else:
-            col_name = 2
+            variance = variance*np.ones(Y.shape[0])
+        if alpha is None:
+            alpha = 1. if user_alpha is None else user_alpha
+        if km is None:
+            km = 35.
+        
+        if self.lik_name == 'Gaussian' and self.transform:
+            Y = np.log(Y+1)
+        
+        # genes with zero initial variance are left to the gene by gene fit
+        valid = variance > 0
+        try:
+            log_likelihood,params,converged = model.fit(Y,model.initial_values(np.where(valid,variance,1.),length_scale,alpha,km))
+        except tf.errors.InvalidArgumentError: # Cholesky decomposition failed for the block
+            return np.full(Y.shape[0],np.nan),{},np.zeros(Y.shape[0],dtype = bool)
         
-        self.model_index = 1  
-        model_1_log_likelihood = self.fit_model()
+        return log_likelihood,params,converged & valid
+    
+    def run_parallel(self,method_name,tasks,n_jobs):
+        """
+        :param method_name: name of the Fit_GPcounts method each worker runs
+        :param tasks: list of argument tuples, one call of the method per task
+        :param n_jobs: number of worker processes
+        :return: list of results in the same order as tasks
+        """
+        # spawn fresh interpreters so every worker builds its own TensorFlow/GPflow state, scripts must start the
+        # tests under an if __name__ == '__main__' guard since workers import the main module again
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs,mp_context=context,
+                                                    initializer=_init_worker,initargs=(self,)) as executor:
+            futures = [executor.submit(_run_worker,method_name,task) for task in tasks]
+            for _ in tqdm(concurrent.futures.as_completed(futures),total=len(futures),disable = not self.progress_bar):
+                pass
+            results = [future.result() for future in futures]
+        
+        return results
+    
+    # fit numbers of GPs = models_number to run the selected test
+    def fit_single_gene(self,index):
+        counts = self.gene_counts(index).astype(float).reshape([-1,1])
+        (X,Z,_),*samples = self.models_data()
+        
+        model_1_log_likelihood = self.fit_model(index,1,X,counts,Z)
         results =  [model_1_log_likelihood]
 
         if self.models_number == 2:
+            model_2_log_likelihood = np.nan
+            ll_ratio = np.nan
             if not(np.isnan(model_1_log_likelihood)):
-                if self.lik_name == 'Negative_binomial':
-                    self.lik_alpha  = self.model.likelihood.alpha.numpy()
-                if self.lik_name == 'Zero_inflated_negative_binomial':
-                    self.lik_km = self.model.likelihood.km.numpy()
-                    self.lik_alpha  = self.model.likelihood.alpha.numpy()
-
-                self.model_index = 2
-                model_2_log_likelihood= self.fit_model()
+                # initialize the constant model with the dispersion of the dynamic model
+                alpha = self.model.likelihood.alpha.numpy() if self.lik_name == 'Negative_binomial' else None
+                model_2_log_likelihood = self.fit_model(index,2,X,counts,Z,alpha = alpha)
 
                 if not(np.isnan(model_2_log_likelihood)):
                     ll_ratio = model_1_log_likelihood - model_2_log_likelihood
 
-            if np.isnan(model_1_log_likelihood) or np.isnan(model_2_log_likelihood):
-                model_2_log_likelihood = np.nan
-                ll_ratio = np.nan
-
             results =  [model_1_log_likelihood,model_2_log_likelihood,ll_ratio] 
 
         if self.models_number == 3:
-
-            X_df = pd.DataFrame(data=self.X,index= self.cells_name,columns= ['times'])
-            Y_df = pd.DataFrame(data=self.Y_copy,index= self.genes_name,columns= self.cells_name)  
-
-            # initialize X and Y with first time series
-            self.set_X_Y(X_df[0 : int(self.N/2)],Y_df.iloc[:,0:int(self.N/2)])
-            self.y = self.Y[self.index].astype(float)
-            self.y = self.y.reshape([self.N,1])
-
-            self.model_index = 2
-            model_2_log_likelihood = self.fit_model() 
-
-            # initialize X and Y with second time series
-            self.set_X_Y(X_df[self.N : :],Y_df.iloc[:,int(self.N) : :])
-            self.y = self.Y[self.index].astype(float)
-            self.y = self.y.reshape([self.N,1])
-
-            self.model_index = 3
-            model_3_log_likelihood = self.fit_model()
-
-            self.set_X_Y(X_df,Y_df)
+            # first and second time series
+            (X_2,Z_2,cells_2),(X_3,Z_3,cells_3) = samples
+            model_2_log_likelihood = self.fit_model(index,2,X_2,counts[cells_2],Z_2)
+            model_3_log_likelihood = self.fit_model(index,3,X_3,counts[cells_3],Z_3)
 
             if np.isnan(model_1_log_likelihood) or np.isnan(model_2_log_likelihood) or np.isnan(model_3_log_likelihood): 
                 ll_ratio = np.nan
@@ -338,139 +749,147 @@ class Fit_GPcounts(object):
 
         return results
     
-    #Save and get log likelihood of successed fit and set likelihood to Nan in case of failure 
-    def fit_model(self,reset = False):
-       
-        fit = self.fit_GP(reset)
-        if fit: # save the model in case of successeded fit
-            if self.sparse and self.lik_name is not 'Gaussian': 
-                log_likelihood = self.model.log_posterior_density((self.X,self.y)).numpy()
-            else:
-                log_likelihood = self.model.log_posterior_density().numpy()
-            
-            # fix positive likelihood by random restart     
-            if log_likelihood > 0 and self.count_fix < 10 and self.safe_mode and self.lik_name is not 'Gaussian':
-                self.count_fix  = self.count_fix + 1
-                log_likelihood = self.fit_model(True)
-               
-            if not np.isnan(log_likelihood):
-                filename = self.get_file_name()
-                ckpt = tf.train.Checkpoint(model=self.model, step=tf.Variable(1))
-                ckpt.write(filename)
-
-        else: # set log likelihood to Nan in case of Cholesky decomposition or optimization failure
-            log_likelihood = np.nan  
-            self.model = np.nan
-           
-        return log_likelihood
-    
-    def fit_GP(self,reset = False):
-        
-        self.init_hyper_parameters(reset=reset) 
+    # fit one model of a gene with geneFit.fit_gene, save it and return its log likelihood, Nan in case of failure
+    def fit_model(self,index,model_index,X,y,Z = None,alpha = None):
+        """
+        :param X: inputs of the model
+        :param y: counts of the gene on these inputs
+        :param Z: inducing points of a sparse model
+        :param alpha: initial dispersion of the constant model
+        """
+        self.start_profile(index,model_index)
+        init = self.init_hyper_parameters(model_index,X,y)
+        if alpha is not None:
+            init['alpha'] = alpha
+        warm_init = None
+        if self.warm_start is not None and not self.branching:
+            warm_init = self.warm_start_hyper_parameters(init,model_index,X,y)
+            if warm_init is not None and alpha is not None: # the dispersion of the dynamic model is kept
+                warm_init['alpha'] = alpha
         
-        fit = True   
-        try:
-            fit = self.fit_GP_with_likelihood()
-            
-        except tf.errors.InvalidArgumentError as e:
-            
-            if self.count_fix < 10: # fix failure by random restart 
-                fit = self.fit_GP(True)
-                
-            else:
-                print('Can not fit a Gaussian process, Cholesky decomposition was not successful.')
-                fit = False
-                
-        if fit and self.optimize and self.count_fix < 5 and not self.branching and self.safe_mode:  
-            self.test_local_optima_case1()
-        return fit
-    
-    # Fit a GP with selected kernel,likelihood,run it as sparse or full GP 
-    def fit_GP_with_likelihood(self):
-        fit = True
+        result = self.fit_gene(index,model_index,X,y,Z,init if warm_init is None else warm_init)
+        if warm_init is not None and self.degenerate_fit(result):
+            # the warm start led to a failed or degenerate fit, fall back to the default initialization
+            result = self.fit_gene(index,model_index,X,y,Z,init)
         
-        #select kernel RBF,constant or branching kernel
-        if self.hyper_parameters['ls'] == -1.: # flag to fit constant kernel
-            kern = gpflow.kernels.Constant(variance= self.hyper_parameters['var']) 
-        else:
-            kern = gpflow.kernels.RBF( variance= self.hyper_parameters['var'],
-                           lengthscales = self.hyper_parameters['ls'])      
+        self.seed_value = result.seed
+        self.model = np.nan if result.model is None else result.model
+        if result.success:
+            if self.warm_start is not None and not self.branching and not self.degenerate_fit(result):
+                self.record_hyper_parameters(model_index,y,result.model)
+            self.save_model(index,model_index,result.model)
         
+        self.end_profile(result.log_likelihood)
+        return result.log_likelihood
+    
+    def fit_gene(self,index,model_index,X,y,Z,init):
+        result = geneFit.fit_gene(X,y,self.lik_name,self.get_kernel_spec(model_index),init,self.global_seed,Z,
+                                  self.fit_options(index))
+        self.restarts = self.restarts + result.restarts
+        for name,value in result.stats.items():
+            self.count_profile(name,value)
+        return result
+    
+    # kernel of geneFit.fit_gene for the model of the selected test
+    def get_kernel_spec(self,model_index):
         if self.branching:
-            del kern
+            kernel_spec = {'name':'Branching','xp':self.xp}
             if self.fix:
-                kern = gpflow.kernels.RBF(variance=self.branching_kernel_var,
-                                          lengthscales=self.branching_kernel_ls)
-                set_trainable(kern.lengthscales,False)
-                set_trainable(kern.variance,False)
-            else:
-                kern = gpflow.kernels.RBF()
-            kernel = branchingKernel.BranchKernel(kern,self.xp)
-        else:
-            kernel = kern
-            
-        #select likelihood
-        if self.lik_name == 'Poisson':
-            likelihood = gpflow.likelihoods.Poisson()
-
-        if self.lik_name == 'Negative_binomial':
-            # library size scaling 
-            if self.nb_scaled:
-                scale=pd.DataFrame(self.scale)
-                self.Scale = self.scale.iloc[:,self.index]
-                self.Scale=np.array(self.Scale)
-                self.Scale=np.transpose([self.Scale] * 20)
-                likelihood = NegativeBinomialLikelihood.NegativeBinomial(self.hyper_parameters['alpha'],scale=self.Scale,nb_scaled=self.nb_scaled)
-            else:
-                likelihood = NegativeBinomialLikelihood.NegativeBinomial(self.hyper_parameters['alpha'],nb_scaled=self.nb_scaled)
-
-       
-        if self.lik_name == 'Zero_inflated_negative_binomial':
-            likelihood = NegativeBinomialLikelihood.ZeroInflatedNegativeBinomial(self.hyper_parameters['alpha'],self.hyper_parameters['km'])
-            
-        # Run model with selected kernel and likelihood       
-        if self.lik_name == 'Gaussian':
-            if self.transform: # use log(count+1) in case of Gaussian likelihood and transform
-                self.y = np.log(self.y+1)
-            
-            if self.sparse:
-                self.model =  gpflow.models.SGPR((self.X,self.y), kernel=kernel,inducing_variable=self.Z)
-                if self.model_index == 2 and self.models_number == 2:
-                    set_trainable(self.model.inducing_variable.Z,False)
-            else:
-                self.model = gpflow.models.GPR((self.X,self.y), kernel)
-                
-            training_loss = self.model.training_loss
-        else:
-                        
-            if self.sparse:
-                self.model = gpflow.models.SVGP( kernel ,likelihood,self.Z) 
-                training_loss = self.model.training_loss_closure((self.X, self.y))
-                if self.model_index == 2 and self.models_number == 2:
-                    set_trainable(self.model.inducing_variable.Z,False)
-                
-            else:
-                self.model = gpflow.models.VGP((self.X, self.y) , kernel , likelihood) 
-                training_loss = self.model.training_loss
-     
-        if self.optimize:
-            o = gpflow.optimizers.Scipy()
-            res = o.minimize(training_loss, variables=self.model.trainable_variables,options=dict(maxiter=5000))
-            
-            if not(res.success): # test if optimization fail
-                if self.count_fix < 10: # fix failure by random restart 
-                    #print('Optimization fail.')     
-                    fit = self.fit_GP(True)
+                kernel_spec.update(variance = self.branching_kernel_var,lengthscales = self.branching_kernel_ls)
+            return kernel_spec
+        if model_index == 2 and self.models_number == 2: # constant model of the one sample test
+            return 'Constant'
+        return 'RBF'
+    
+    # options of geneFit.fit_gene from the settings of the test
+    def fit_options(self,index = None):
+        scale = None
+        if self.nb_scaled: # library size scaling 
+            scale = np.array(self.scale.iloc[:,index])
+            scale = np.transpose([scale] * 20)
+        return {'safe_mode':self.safe_mode,'transform':self.transform,'nb_scaled':self.nb_scaled,'scale':scale,
+                'zero_split':self.zero_split,'minibatch_size':self.minibatch_size,'minibatch_options':self.minibatch_options,
+                'local_optima_check':self.local_optima_check,'f_samples_number':self.f_samples_number,
+                'y_samples_number':self.y_samples_number,'kernel_cache':self.kernel_cache,
+                'compiled_models':self.compiled_models if self.compiled_fit else None,
+                'minibatch_models':self.minibatch_models}
+    
+    # open the record of the model being fitted when profiling or when hooks are attached
+    def start_profile(self,index,model_index):
+        if not self.profile and not self.profile_hooks:
+            return
+        self.profile_record = {'gene':self.genes_name[index],'model_index':model_index,'fit_time':0.,
+                               'optimize_time':0.,'nit':0,'restarts':0,'cholesky_failures':0,'optimization_failures':0,
+                               'local_optima_restarts':0,'positive_likelihood_restarts':0,'local_optima_time':0.,
+                               'log_likelihood':np.nan}
+        self.profile_start = (time.perf_counter(),self.restarts)
+        for hook in self.profile_hooks:
+            hook('start',self.profile_record)
+    
+    def count_profile(self,name,value = 1):
+        if self.profile_record is not None:
+            self.profile_record[name] += value
+    
+    def end_profile(self,log_likelihood):
+        record = self.profile_record
+        if record is None:
+            return
+        start,restarts = self.profile_start
+        record['fit_time'] = time.perf_counter()-start
+        record['restarts'] = self.restarts-restarts
+        record['log_likelihood'] = log_likelihood
+        if self.profile:
+            self.profile_records.append(record)
+        for hook in self.profile_hooks:
+            hook('end',record)
+        self.profile_record = None
+    
+    def profile_report(self):
+        """
+        :return: one row per model fitted by the latest test with profile = True: gene, model index, fit time, time spent 
+        building and optimizing models, optimizer iterations, random restarts by cause, sampling time of the local optima check and 
+        log likelihood. Genes fitted together by batch_size are not profiled, only those refitted one by one.
+        """
+        columns = ['gene','model_index','fit_time','optimize_time','nit','restarts','cholesky_failures','optimization_failures',
+                   'local_optima_restarts','positive_likelihood_restarts','local_optima_time','log_likelihood']
+        return pd.DataFrame(self.profile_records,columns = columns)
+    
+    def compiled_fit_report(self):
+        """
+        :return: per compiled model the number of fits and loss evaluations, the compile time spent tracing,
+        compiling and running the first evaluation and the run time of all later evaluations in seconds
+        """
+        report = {}
+        for compiled_model in self.compiled_models.values():
+            report[compiled_model.name] = [compiled_model.fits,compiled_model.evaluations,
+                                           compiled_model.compile_time,compiled_model.run_time]
+        return pd.DataFrame.from_dict(report,orient = 'index',columns = ['fits','evaluations','compile_time','run_time'])
 
-                else:
-                    print('Can not Optimaize a Gaussian process, Optimization fail.')
-                    fit = False
-        return fit
+    def restore_model(self,X,y,params = None,file_name = None,index = None,model_index = 1,Z = None):
+        """
+        Build the model of a gene from saved parameters, nothing is optimized or sampled
+        :param X: inputs of the model
+        :param y: counts of the gene, log transformed here for the Gaussian likelihood
+        :param params: parameters from gpflow.utilities.parameter_dict, the kernel and sparse or full model are read from their names
+        :param file_name: checkpoint of the model, the kernel follows the model_index of the current test and the model is sparse
+        when inducing points Z are given
+        :return: the restored model, also set as self.model
+        """
+        self.model = geneFit.restore_model(X,y,self.lik_name,self.get_kernel_spec(model_index),params,file_name,Z,
+                                           self.fit_options(index))
+        return self.model
     
-    def get_file_name(self):
-        
-        if not os.path.exists(self.folder_name):
-            os.mkdir(self.folder_name)
+    def save_model(self,index,model_index,model):
+        if self.save_models == 'checkpoint':
+            filename = self.get_file_name(index,model_index)
+            ckpt = tf.train.Checkpoint(model=model, step=tf.Variable(1))
+            ckpt.write(filename)
+        elif self.save_models == 'store':
+            if self.model_store is None:
+                self.model_store = modelStore.ModelStore(self.get_store_name())
+            self.model_store.add(self.get_model_key(index,model_index),model)
+    
+    def get_file_prefix(self):
         
         filename = self.folder_name+self.lik_name+'_'
 
@@ -479,134 +898,115 @@ class Fit_GPcounts(object):
         
         if self.models_number == 3:
             filename += 'tst_'  
-        
-        filename += self.genes_name[self.index]+'_model_'+str(self.model_index)
         return filename
     
-     # user assign the default values for hyper_parameters
+    def get_file_name(self,index,model_index):
+        
+        # worker processes may create the folder concurrently
+        os.makedirs(self.folder_name,exist_ok = True)
+        return self.get_file_prefix()+self.get_model_key(index,model_index)
+    
+    # single file holding the models of all genes for the selected likelihood and test
+    def get_store_name(self):
+        return self.get_file_prefix()+'models.npz'
+    
+    def get_model_key(self,index,model_index):
+        return self.genes_name[index]+'_model_'+str(model_index)
+    
+     # user assign the default values for hyper_parameters, those not given are set for every gene by init_hyper_parameters
     def initialize_hyper_parameters(self,length_scale = None,variance = None,alpha = None,km = None):
-        if length_scale is None: 
-            self.hyper_parameters['ls'] = (5*(np.max(self.X)-np.min(self.X)))/100
-        else:
-            self.hyper_parameters['ls'] = length_scale
+        self.user_hyper_parameters = [length_scale,variance,alpha,km]
         
-        if variance is None: 
-            if self.lik_name == 'Gaussian' and not self.transform:
-                self.hyper_parameters['var'] = np.mean(self.y+1**2) 
-            else:
-                self.hyper_parameters['var'] = np.mean(np.log(self.y+1)**2)
-                
-        else:
-            self.hyper_parameters['var'] = variance
-       
-        if alpha is None: 
-            self.hyper_parameters['alpha'] = 1.
-        else:
-            self.hyper_parameters['alpha'] = alpha
+    # default initial hyper-parameters of a model fitted to counts y on inputs X
+    def init_hyper_parameters(self,model_index,X,y):
+        return geneFit.initial_hyper_parameters(X,y,self.lik_name,self.transform,*self.user_hyper_parameters)
+    
+    # counts of a gene, the chunk holding it is loaded when Y is read from a file
+    def gene_counts(self,index):
+        if self.reader is not None and (self.Y is None or not self.Y_offset <= index < self.Y_offset+self.Y.shape[0]):
+            self.Y_offset,self.Y = self.reader.chunk_of(index)
+            if self.lik_name != 'Gaussian':
+                values = self.Y.data if self.sparse_counts else self.Y
+                np.trunc(values,out = values)
+        counts = self.Y[index-self.Y_offset]
+        if self.sparse_counts:
+            counts = counts.toarray()[0]
+        return counts
+    
+    # log mean and log method of moments dispersion of gene counts y
+    def gene_features(self,y):
+        mean = np.mean(y)
+        dispersion = (np.var(y)-mean)/mean**2 if mean > 0 else 0.
+        return np.array([np.log(mean+1),np.log(max(dispersion,1e-3))])
+    
+    # hyper-parameters of a fitted model named as in geneFit.initial_hyper_parameters
+    def model_hyper_parameters(self,model):
+        params = {'var':model.kernel.variance.numpy()}
+        if hasattr(model.kernel,'lengthscales'):
+            params['ls'] = model.kernel.lengthscales.numpy()
+        if hasattr(model.likelihood,'alpha'):
+            params['alpha'] = model.likelihood.alpha.numpy()
+        if hasattr(model.likelihood,'km'):
+            params['km'] = model.likelihood.km.numpy()
+        return params
+    
+    # failed fit, non finite or positive log likelihood of counts or hyper-parameters at the boundary of their range 
+    def degenerate_fit(self,result):
+        if not result.success or not np.isfinite(result.log_likelihood):
+            return True
+        if result.log_likelihood > 0 and self.lik_name != 'Gaussian':
+            return True
+        return any(not np.isfinite(value) or value < geneFit.Minimum_hyper_parameter 
+                   for value in self.model_hyper_parameters(result.model).values())
+    
+    # save hyper-parameters of a converged model to warm start the next genes
+    def record_hyper_parameters(self,model_index,y,model):
+        if model_index not in self.fitted_hyper_parameters:
+            self.fitted_hyper_parameters[model_index] = deque(maxlen = self.warm_start_window)
+        self.fitted_hyper_parameters[model_index].append((self.gene_features(y),self.model_hyper_parameters(model)))
+    
+    # initialization of hyper_parameters from the empirical prior of converged genes, None before any gene converged.
+    # values are clamped to the range of random restarts widened to hold the default initialization
+    def warm_start_hyper_parameters(self,hyper_parameters,model_index,X,y):
+        records = self.fitted_hyper_parameters.get(model_index)
+        if not records:
+            return None
         
-        if km is None: 
-            self.hyper_parameters['km'] = 35.
-        else:
-            self.hyper_parameters['km'] = km
+        if self.warm_start == 'nearest': # genes with the closest mean and dispersion
+            features = np.vstack([record[0] for record in records])
+            nearest = np.argmin(np.sum((features-self.gene_features(y))**2,axis = 1))
+            params = records[nearest][1]
+        else: # running median over the latest converged genes
+            params = {}
+            for name in ['var','ls','alpha','km']:
+                values = [record[1][name] for record in records if name in record[1]]
+                if values:
+                    params[name] = np.median(values)
         
-        self.user_hyper_parameters = [length_scale,variance,alpha,km]
+        # user assigned values take precedence
+        warm_hyper_parameters = dict(hyper_parameters)
+        ranges = geneFit.hyper_parameters_ranges(X)
+        for name,user_value in zip(['ls','var','alpha','km'],self.user_hyper_parameters):
+            if user_value is None and name in params:
+                low = max(ranges[name][0],geneFit.Minimum_hyper_parameter)
+                high = max(ranges[name][1],hyper_parameters[name])
+                warm_hyper_parameters[name] = float(np.clip(params[name],low,high))
+        return warm_hyper_parameters
         
-    # Hyper-parameters initialization or restting in case of failure 
-    def init_hyper_parameters(self,reset = False):
-        
-        if not reset:
-            self.seed_value = 0
-            self.count_fix = 0 
-            np.random.seed(self.seed_value)
-        self.initialize_hyper_parameters(self.user_hyper_parameters[0],self.user_hyper_parameters[1],
-                                            self.user_hyper_parameters[2],self.user_hyper_parameters[3])                                  
-        # in case of failure change the seed and sample hyper-parameters from uniform distributions
-        if reset:
-            self.count_fix = self.count_fix +1 
-            self.seed_value = self.seed_value + 1
-            np.random.seed(self.seed_value)
-            self.hyper_parameters['ls'] = np.random.uniform((.25*(np.max(self.X)-np.min(self.X)))/100 ,(30.*(np.max(self.X)-np.min(self.X)))/100)
-            self.hyper_parameters['var'] = np.random.uniform(0. ,10.)
-            self.hyper_parameters['alpha'] = np.random.uniform(0., 10.)
-            self.hyper_parameters['km'] = np.random.uniform(0., 100.) 
-            
-        # set ls to 1000 in case of one sample test when fit the constant model    
-        if self.model_index == 2 and self.models_number == 2:
-            self.hyper_parameters['ls'] = -1. 
-            
-            if self.optimize and self.count_fix == 0:
-                if self.lik_name == 'Negative_binomial':
-                    self.hyper_parameters['alpha'] = self.lik_alpha
-                    
-        else:
-            #save likelihood parameters to initialize constant model 
-            self.lik_alpha = None 
-            self.lik_km = None
-            if not self.branching:
-                self.fix = False # fix kernel hyper-parameters
-        
-        # reset gpflow graph
-        tf.compat.v1.get_default_graph()
-        tf.compat.v1.set_random_seed(self.seed_value)
-        tf.random.set_seed(self.seed_value)
-        gpflow.config.set_default_float(np.float64)
-         
-        self.y = self.Y[self.index].astype(float)
-        self.y = self.y.reshape([-1,1])   
-        self.model = None
-        self.var = None 
-        self.mean = None   
-    
-    def generate_Samples_from_distribution(self,mean):
-        
-        y = []
-        if self.lik_name == 'Poisson':
-            for i in range(mean.shape[0]):
-                y.append(ss.poisson.rvs(mean[i], size = 500))
-
-        if self.lik_name == 'Negative_binomial':
-            if self.model.likelihood.alpha.numpy() == 0:
-                for i in range(mean.shape[0]):
-                     y.append(ss.poisson.rvs(mean[i], size = 500))
-                
-            else:
-                r = 1./self.model.likelihood.alpha.numpy()  # r  number of failures
-            prob = r / (mean+ r)   # p probability of success
-            for i in range(mean.shape[0]):
-                y.append(ss.nbinom.rvs(r, prob[i], size = 500))
-
-        if self.lik_name == 'Zero_inflated_negative_binomial':
-            r = 1./self.model.likelihood.alpha.numpy()  # r  number of failures
-            prob = r / (mean+ r)   # p probability of success
-            km = self.model.likelihood.km.numpy() # Michaelin-Menten (MM) constant
-            psi = 1.- (mean/(km+mean)) # psi probability of zeros
-            for i in range(mean.shape[0]):
-                B = ss.bernoulli.rvs(size=1,p = 1-psi[i])
-                if B == 0:
-                    y.append(np.zeros(500))
-                else:
-                    y.append(ss.nbinom.rvs(r, prob[i], size = 500))       
-        y = np.vstack(y)
-        return y
+    def generate_Samples_from_distribution(self,mean,rng = None):
+        """
+        :param mean: mean of the counts distribution at each test point, array of any shape
+        :param rng: numpy random Generator, seeded with seed_value if None
+        :return: samples from the selected likelihood of shape (y_samples_number,) + mean.shape
+        """
+        if rng is None:
+            rng = np.random.default_rng(self.seed_value)
+        return geneFit.generate_samples(self.model,self.lik_name,mean,self.y_samples_number,rng)
 
     def samples_posterior_predictive_distribution(self,xtest):
-        
-        var = []
-        f_samples = []
-        for i in range(20):
-            f_samples.append(self.model.predict_f_samples(xtest, 5))
-            f = np.vstack(f_samples)
-            link_f = np.exp(f[:, :, 0])
-            var.append(self.generate_Samples_from_distribution(np.mean(link_f, 0)).T)
-
-        var = np.vstack(var)
-        if self.branching:
-            mean = np.mean(link_f, axis=0)
-        else:
-            mean = np.mean(var,axis = 0)
-            mean = savgol_filter(np.mean(var,axis = 0), int(xtest.shape[0]/2)+1, 3)
-            mean = [(i > 0) * i for i in mean]
-        return mean,var
+        return geneFit.samples_posterior_predictive_distribution(self.model,self.lik_name,xtest,self.seed_value,
+                                                                 self.f_samples_number,self.y_samples_number,
+                                                                 bool(self.branching))
   
     def load_predict_models(self,genes_name,test_name,likelihood = 'Negative_binomial',predict = True):        
         params = {}
@@ -624,47 +1024,40 @@ class Fit_GPcounts(object):
             self.models_number = 3
         else:
             self.models_number = 1
+        
+        if self.models_number == 3:
+            self.set_samples()
             
         xtest = np.linspace(np.min(self.X)-.1,np.max(self.X)+.1,100)[:,None]
+        if self.save_models == 'store':
+            store = modelStore.ModelStore(self.get_store_name()).load()
         
-        for gene in tqdm(genes_name):
+        for gene in tqdm(genes_name,disable = not self.progress_bar):
             models = []
             means = []
             variances = []
 
-            self.index = self.genes_name.index(gene)
-           
-            self.y = self.Y[self.index]
-            self.y = self.y.reshape([self.N,1])
+            index = self.genes_name.index(gene)
+            counts = self.gene_counts(index).astype(float).reshape([-1,1])
                 
-            for model_index in range(self.models_number):
+            for model_index,(X,Z,cells) in enumerate(self.models_data(),1):
                
-                self.optimize = False
-                self.model_index = model_index + 1
-                self.init_hyper_parameters(reset = False) 
-                file_name = self.get_file_name()
-               
-                if self.models_number == 3:
-                    X_df = pd.DataFrame(data=self.X,index= self.cells_name,columns= ['times'])
-                    Y_df = pd.DataFrame(data=self.Y_copy,index= self.genes_name,columns= self.cells_name)
-                    
-                    if model_index == 0:
-                        self.set_X_Y(X_df,Y_df)
-                        
-                    if model_index == 1: # initialize X and Y with first time series
-                        self.set_X_Y(X_df[0 : int(self.N/2)],Y_df.iloc[:,0:int(self.N/2)])
-
-                    if model_index == 2: # initialize X and Y with second time series
-                        self.set_X_Y(X_df[int(self.N/2) : :],Y_df.iloc[:,int(self.N/2) : :])
+                self.seed_value = self.global_seed
+                y = counts[cells]
+                model_key = self.get_model_key(index,model_index)
+                # models are rebuilt from the saved parameters, failed fits were not saved
+                if self.save_models == 'store':
+                    stored_params = store.get(model_key)
+                    successed_fit = stored_params is not None
+                    if successed_fit:
+                        self.restore_model(X,y,params = stored_params,index = index)
+                else:
+                    file_name = self.get_file_prefix()+model_key
+                    successed_fit = os.path.exists(file_name+'.index')
+                    if successed_fit:
+                        self.restore_model(X,y,file_name = file_name,index = index,model_index = model_index,Z = Z)
                     
-                self.y = self.Y[self.index]
-                self.y = self.y.reshape([self.N,1])
-                successed_fit = self.fit_GP()
-                # restore check point
                 if successed_fit:
-                    ckpt = tf.train.Checkpoint(model=self.model, step=tf.Variable(1))
-                    ckpt.restore(file_name)
-                    
                     if predict: 
                         if self.lik_name == 'Gaussian':
                             mean, var = self.model.predict_y(xtest)
@@ -677,13 +1070,11 @@ class Fit_GPcounts(object):
                          mean = var = 0
                 else:
                     mean = var = 0
+                    self.model = np.nan
                     
                 means.append(mean)
                 variances.append(var)
                 models.append(self.model)
-
-                if self.models_number == 3 and model_index > 0:
-                    self.set_X_Y(X_df,Y_df)
             
             genes_means.append(means)
             genes_vars.append(variances)
@@ -694,100 +1085,6 @@ class Fit_GPcounts(object):
         params['models']= genes_models
         
         return params
-    
-    def test_local_optima_case1(self):
-        # limit number of trial to fix bad solution 
-        if self.sparse:
-            x = self.Z
-        else:
-            x = self.X 
-
-        if self.X.shape[1] == 1:   
-                xtest = np.linspace(np.min(x),np.max(x),100)[:,None]
-        else: xtest = self.X
-        if self.lik_name == 'Gaussian':
-            mean, var = self.model.predict_y(xtest)
-            self.mean = mean.numpy()
-            self.var = var.numpy()
-        else:
-            # mean of posterior predictive samples
-            self.mean,self.var = self.samples_posterior_predictive_distribution(xtest)        
-
-        mean_mean = np.mean(self.mean) 
-        y_max = np.max(self.y)
-        mean_max = np.max(self.mean)
-        y_min = np.min(self.y)
-        mean_min = np.min(self.mean)
-        y_mean = np.mean(self.y)
-        mean_mean = np.mean(self.mean)
-       
-        if self.N < 100:
-            diff = 0
-        else:
-            diff = 1
-        if self.model_index == 2 and self.models_number == 2:
-            if mean_min < y_min or mean_max > y_max or mean_mean == 0.0:     
-                fit = self.fit_GP(True)
-            
-        if y_mean > 0.0:
-            diff_mean = abs(round((mean_mean-y_mean)/y_mean))
-            if diff_mean > diff and mean_min < y_min or diff_mean > diff and mean_max > y_max or mean_mean == 0.0:     
-                fit = self.fit_GP(True)
-
 
     def qvalue(self,pv, pi0=None):
-        '''
-        Estimates q-values from p-values
-        This function is modified based on https://github.com/nfusi/qvalue
-        Args
-        ====
-        pi0: if None, it's estimated as suggested in Storey and Tibshirani, 2003.
-        '''
-        assert(pv.min() >= 0 and pv.max() <= 1), "p-values should be between 0 and 1"
-
-        original_shape = pv.shape
-        pv = pv.ravel()  # flattens the array in place, more efficient than flatten()
-
-        m = float(len(pv))
-
-        # if the number of hypotheses is small, just set pi0 to 1
-        if len(pv) < 100 and pi0 is None:
-            pi0 = 1.0
-        elif pi0 is not None:
-            pi0 = pi0
-        else:
-            # evaluate pi0 for different lambdas
-            pi0 = []
-            lam = sp.arange(0, 0.90, 0.01)
-            counts = sp.array([(pv > i).sum() for i in sp.arange(0, 0.9, 0.01)])
-            for l in range(len(lam)):
-                pi0.append(counts[l]/(m*(1-lam[l])))
-
-            pi0 = sp.array(pi0)
-
-            # fit natural cubic spline
-            tck = interpolate.splrep(lam, pi0, k=3)
-            pi0 = interpolate.splev(lam[-1], tck)
-
-            if pi0 > 1:
-                pi0 = 1.0
-
-        assert(pi0 >= 0 and pi0 <= 1), "pi0 is not between 0 and 1: %f" % pi0
-
-        p_ordered = sp.argsort(pv)
-        pv = pv[p_ordered]
-        qv = pi0 * m/len(pv) * pv
-        qv[-1] = min(qv[-1], 1.0)
-
-        for i in range(len(pv)-2, -1, -1):
-            qv[i] = min(pi0*m*pv[i]/(i+1.0), qv[i+1])
-
-        # reorder qvalues
-        qv_temp = qv.copy()
-        qv = sp.zeros_like(qv)
-        qv[p_ordered] = qv_temp
-
-        # reshape qvalues
-        qv = qv.reshape(original_shape)
-
-        return qv    
+        return qvalue(pv,pi0)
@@ -1,5 +1,4 @@
 import tensorflow as tf
-import numpy as np
 from gpflow.likelihoods import ScalarLikelihood
 from gpflow.base import Parameter
 from gpflow.config import default_float
@@ -7,7 +6,7 @@ from gpflow.utilities import positive
 
 
 class NegativeBinomial(ScalarLikelihood):
-    def __init__(self, alpha= 1.0,invlink=tf.exp,scale=1.0,nb_scaled=False, **kwargs):
+    def __init__(self, alpha= 1.0,invlink=tf.exp,scale=1.0,nb_scaled=False,zero_split=False, **kwargs):
         super().__init__( **kwargs)
         self.alpha = Parameter(alpha,
                                transform= positive(),
@@ -15,6 +14,7 @@ class NegativeBinomial(ScalarLikelihood):
         self.scale = Parameter(scale,trainable=False,dtype=default_float())
         self.invlink = invlink
         self.nb_scaled = nb_scaled
+        self.zero_split = zero_split # evaluate zero counts terms only on zero counts
 
     def _scalar_log_prob(self, F, Y): 
         """
@@ -29,6 +29,9 @@ class NegativeBinomial(ScalarLikelihood):
         '''
         if self.nb_scaled == True:
             return negative_binomial(self.invlink(F)*self.scale , Y, self.alpha)
+        elif self.zero_split:
+            return split_zero_counts(self.invlink(F), Y, lambda m: negative_binomial_zero(m, self.alpha),
+                                     lambda m, Y: negative_binomial(m, Y, self.alpha))
         else:  
             return negative_binomial(self.invlink(F) , Y, self.alpha)
     
@@ -49,8 +52,28 @@ def negative_binomial(m, Y, alpha):
     k = 1 / alpha
     return tf.math.lgamma(k + Y) - tf.math.lgamma(Y + 1) - tf.math.lgamma(k) + Y * tf.math.log(m / (m + k)) - k * tf.math.log(1 + m * alpha)
 
+def negative_binomial_zero(m, alpha):
+    # negative_binomial at Y = 0
+    return - tf.math.log(1. + m * alpha) / alpha
+
+def split_zero_counts(m, Y, log_prob_zero, log_prob_nonzero):
+    '''
+    Evaluate log_prob_zero(m) only where Y is zero and log_prob_nonzero(m,Y) only where Y is not zero,
+    instead of evaluating both everywhere and selecting with tf.where. Cheaper on sparse counts.
+    '''
+    shape = tf.broadcast_dynamic_shape(tf.shape(m), tf.shape(Y))
+    m = tf.reshape(tf.broadcast_to(m, shape), [-1])
+    Y = tf.reshape(tf.broadcast_to(Y, shape), [-1])
+    zero = tf.equal(Y, 0)
+    zero_index = tf.cast(tf.where(zero)[:, 0], tf.int32)
+    nonzero_index = tf.cast(tf.where(tf.logical_not(zero))[:, 0], tf.int32)
+    log_p = tf.dynamic_stitch([zero_index, nonzero_index],
+                              [log_prob_zero(tf.gather(m, zero_index)),
+                               log_prob_nonzero(tf.gather(m, nonzero_index), tf.gather(Y, nonzero_index))])
+    return tf.reshape(log_p, shape)
+
 class ZeroInflatedNegativeBinomial(ScalarLikelihood):
-    def __init__(self, alpha = 1.0,km = 1.0, invlink=tf.exp,  **kwargs):
+    def __init__(self, alpha = 1.0,km = 1.0, invlink=tf.exp,zero_split=False,  **kwargs):
         super().__init__( **kwargs)
         self.alpha = Parameter(alpha,
                                transform= positive(),
@@ -60,15 +83,13 @@ class ZeroInflatedNegativeBinomial(ScalarLikelihood):
                            dtype=default_float())
         
         self.invlink = invlink
+        self.zero_split = zero_split # evaluate zero counts terms only on zero counts
 
     def _scalar_log_prob(self, F, Y):
-        m = self.invlink(F)
-        psi = 1. - (m / (self.km + m))
-        comparison = tf.equal(Y, 0)
-        nb_zero = - tf.math.log(1. + m * self.alpha) / self.alpha
-        log_p_zero = tf.reduce_logsumexp([tf.math.log(psi), tf.math.log(1.-psi) + nb_zero], axis=0)
-        log_p_nonzero = tf.math.log(1.-psi) + negative_binomial(m, Y, self.alpha)
-        return tf.where(comparison, log_p_zero, log_p_nonzero)
+        if self.zero_split:
+            return split_zero_counts(self.invlink(F), Y, lambda m: zero_inflated_negative_binomial_zero(m, self.alpha, self.km),
+                                     lambda m, Y: zero_inflated_negative_binomial_nonzero(m, Y, self.alpha, self.km))
+        return zero_inflated_negative_binomial(self.invlink(F), Y, self.alpha, self.km)
 
     def _conditional_mean(self, F):
         m = self.invlink(F)
@@ -79,3 +100,16 @@ class ZeroInflatedNegativeBinomial(ScalarLikelihood):
         m = self.invlink(F)
         psi = 1. - (m /(self.km + m))
         return m * (1-psi)*(1 + (m * (psi+self.alpha)))
+
+def zero_inflated_negative_binomial_zero(m, alpha, km):
+    psi = 1. - (m / (km + m))
+    return tf.reduce_logsumexp([tf.math.log(psi), tf.math.log(1.-psi) + negative_binomial_zero(m, alpha)], axis=0)
+
+def zero_inflated_negative_binomial_nonzero(m, Y, alpha, km):
+    psi = 1. - (m / (km + m))
+    return tf.math.log(1.-psi) + negative_binomial(m, Y, alpha)
+
+def zero_inflated_negative_binomial(m, Y, alpha, km):
+    comparison = tf.equal(Y, 0)
+    return tf.where(comparison, zero_inflated_negative_binomial_zero(m, alpha, km),
+                    zero_inflated_negative_binomial_nonzero(m, Y, alpha, km))
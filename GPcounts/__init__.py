@@ -1,2 +1 @@
-from . import GPcounts_Module,NegativeBinomialLikelihood,branchingKernel
-
+from . import GPcounts_Module,NegativeBinomialLikelihood,branchingKernel,batchedGP,kernelCache,modelStore,countsReader,compiledModel,inducingPoints,geneFit
@@ -0,0 +1,274 @@
+import threading
+import concurrent.futures
+import numpy as np
+import scipy.optimize
+import tensorflow as tf
+from gpflow.config import default_float, default_jitter
+from gpflow.utilities import positive, triangular
+from GPcounts.NegativeBinomialLikelihood import negative_binomial, zero_inflated_negative_binomial
+
+
+class BatchedGP(object):
+    '''
+    B independent GPs, one per gene, that share the inputs X and are fitted together in one
+    TensorFlow graph with per gene kernel and likelihood hyper-parameters.
+    Non Gaussian likelihoods use the whitened variational posterior of gpflow.models.VGP and the
+    Gaussian likelihood uses the exact marginal likelihood of gpflow.models.GPR, so the returned
+    log likelihoods are comparable with the models fitted gene by gene.
+    Every gene is optimized by its own scipy L-BFGS-B, as in the gene by gene fit, and the loss and
+    gradient requested by the optimizers of all genes are evaluated together by one compiled graph.
+    '''
+
+    def __init__(self, X, lik_name, constant_kernel=False, num_gauss_hermite_points=20):
+        self.N = X.shape[0]
+        self.lik_name = lik_name
+        self.constant_kernel = constant_kernel
+        self.variational = lik_name != 'Gaussian'
+
+        # squared distances between inputs are shared by all genes
+        X = tf.convert_to_tensor(X, dtype=default_float())
+        X2 = tf.reduce_sum(tf.square(X), axis=-1)
+        self.r2 = tf.maximum(X2[:, None] + X2[None, :] - 2. * tf.matmul(X, X, transpose_b=True), 0.)
+
+        self.compiled = None  # compiled loss and gradient
+
+        gh_x, gh_w = np.polynomial.hermite.hermgauss(num_gauss_hermite_points)
+        self.gh_x = tf.constant(gh_x * np.sqrt(2.), dtype=default_float())
+        self.gh_w = tf.constant(gh_w / np.sqrt(np.pi), dtype=default_float())
+
+        # name, size and transform of the parameters packed in each gene row of the unconstrained vector
+        self.parameters = [('variance', 1, positive())]
+        if not constant_kernel:
+            self.parameters.append(('lengthscales', 1, positive()))
+        if lik_name == 'Gaussian':
+            self.parameters.append(('noise_variance', 1, positive(lower=1e-6)))
+        if lik_name in ['Negative_binomial', 'Zero_inflated_negative_binomial']:
+            self.parameters.append(('alpha', 1, positive()))
+        if lik_name == 'Zero_inflated_negative_binomial':
+            self.parameters.append(('km', 1, positive()))
+        if self.variational:
+            self.parameters.append(('q_mu', self.N, None))
+            self.parameters.append(('q_sqrt', self.N * (self.N + 1) // 2, triangular()))
+
+    def pack(self, values):
+        # values holds constrained arrays of shape [B], [B, N] or [B, N, N] for every parameter
+        x = []
+        for name, size, transform in self.parameters:
+            value = tf.convert_to_tensor(values[name], dtype=default_float())
+            if transform is not None:
+                value = transform.inverse(value)
+            x.append(tf.reshape(value, [value.shape[0], size]))
+        return tf.concat(x, axis=1)
+
+    def unpack(self, x):
+        values = {}
+        start = 0
+        for name, size, transform in self.parameters:
+            value = x[:, start:start + size]
+            if size == 1:
+                value = value[:, 0]
+            values[name] = value if transform is None else transform.forward(value)
+            start += size
+        return values
+
+    def K(self, values):
+        variance = values['variance'][:, None, None]
+        if self.constant_kernel:
+            return variance * tf.ones_like(self.r2)[None, :, :]
+        lengthscales = values['lengthscales'][:, None, None]
+        return variance * tf.exp(-0.5 * self.r2[None, :, :] / tf.square(lengthscales))
+
+    def log_prob(self, F, Y, values):
+        alpha = values['alpha'][:, None, None]
+        if self.lik_name == 'Negative_binomial':
+            return negative_binomial(tf.exp(F), Y, alpha)
+        km = values['km'][:, None, None]
+        return zero_inflated_negative_binomial(tf.exp(F), Y, alpha, km)
+
+    def log_likelihood(self, x, Y):
+        '''
+        :param x: unconstrained parameters B X P
+        :param Y: counts B X N
+        :return: log posterior density of every gene, the ELBO for variational models
+        '''
+        values = self.unpack(x)
+        K = self.K(values)
+        eye = tf.eye(self.N, dtype=default_float())[None, :, :]
+
+        if not self.variational:
+            L = tf.linalg.cholesky(K + values['noise_variance'][:, None, None] * eye)
+            a = tf.linalg.triangular_solve(L, Y[:, :, None], lower=True)[:, :, 0]
+            return (-0.5 * tf.reduce_sum(tf.square(a), axis=1)
+                    - tf.reduce_sum(tf.math.log(tf.linalg.diag_part(L)), axis=1)
+                    - 0.5 * self.N * np.log(2. * np.pi))
+
+        q_mu = values['q_mu']
+        q_sqrt = values['q_sqrt']
+        KL = 0.5 * (tf.reduce_sum(tf.square(q_sqrt), axis=[1, 2]) + tf.reduce_sum(tf.square(q_mu), axis=1)
+                    - self.N - tf.reduce_sum(tf.math.log(tf.square(tf.linalg.diag_part(q_sqrt))), axis=1))
+
+        L = tf.linalg.cholesky(K + default_jitter() * eye)
+        fmean = tf.linalg.matvec(L, q_mu)
+        fvar = tf.reduce_sum(tf.square(tf.linalg.matmul(L, q_sqrt)), axis=2)
+
+        if self.lik_name == 'Poisson':
+            # closed form variational expectations of gpflow.likelihoods.Poisson
+            var_exp = Y * fmean - tf.exp(fmean + fvar / 2.) - tf.math.lgamma(Y + 1.)
+        else:
+            # Gauss-Hermite quadrature of the variational expectations, B X N X H
+            F = fmean[:, :, None] + tf.sqrt(fvar)[:, :, None] * self.gh_x
+            var_exp = tf.reduce_sum(self.log_prob(F, Y[:, :, None], values) * self.gh_w, axis=2)
+
+        return tf.reduce_sum(var_exp, axis=1) - KL
+
+    def loss_and_gradient(self, x, Y):
+        # losses of the genes are independent, the gradient of their sum holds the gradient of every gene in its row
+        with tf.GradientTape() as tape:
+            tape.watch(x)
+            loss = -self.log_likelihood(x, Y)
+            total_loss = tf.reduce_sum(loss)
+        return loss, tape.gradient(total_loss, x)
+
+    def compiled_loss_and_gradient(self):
+        # traced once, the genes still being optimized are evaluated whatever their number
+        if self.compiled is None:
+            P = sum(size for _, size, _ in self.parameters)
+            signature = [tf.TensorSpec([None, P], dtype=default_float()),
+                         tf.TensorSpec([None, self.N], dtype=default_float())]
+            self.compiled = tf.function(self.loss_and_gradient, input_signature=signature)
+        return self.compiled
+
+    def initial_values(self, variance, lengthscales=None, alpha=None, km=None):
+        B = len(variance)
+        values = {'variance': variance}
+        if not self.constant_kernel:
+            values['lengthscales'] = lengthscales * np.ones(B)
+        if self.lik_name == 'Gaussian':
+            values['noise_variance'] = np.ones(B)
+        if self.lik_name in ['Negative_binomial', 'Zero_inflated_negative_binomial']:
+            values['alpha'] = alpha * np.ones(B)
+        if self.lik_name == 'Zero_inflated_negative_binomial':
+            values['km'] = km * np.ones(B)
+        if self.variational:
+            values['q_mu'] = np.zeros((B, self.N))
+            values['q_sqrt'] = np.tile(np.eye(self.N), (B, 1, 1))
+        return values
+
+    def fit(self, Y, values, maxiter=5000, restarts=1, stationary_gradient=1e-2):
+        '''
+        :param Y: counts of B genes, B X N
+        :param values: initial constrained parameters from initial_values
+        :param maxiter: L-BFGS-B iterations of every gene
+        :param restarts: L-BFGS-B restarts of the genes that did not converge, from the position where they stopped
+        :param stationary_gradient: genes whose line search failed where no gradient entry is larger are converged,
+        their loss is flat to rounding around an optimum at the boundary of the positive hyper-parameters
+        :return: log likelihood, fitted constrained parameters and convergence mask of every gene
+        '''
+        Y = tf.convert_to_tensor(Y, dtype=default_float())
+        x = self.pack(values).numpy()
+        converged = np.zeros(len(x), dtype=bool)
+        # the line search of L-BFGS-B stops near the optimum of some genes, a fresh curvature estimate finishes most
+        # of them without a gene by gene refit
+        for _ in range(restarts+1):
+            genes = np.where(~converged)[0]
+            if len(genes) == 0:
+                break
+            for i, res in zip(genes, self.minimize(x, Y, genes, maxiter)):
+                x[i] = res.x
+                converged[i] = res.success or np.max(np.abs(res.jac)) < stationary_gradient
+
+        x = tf.convert_to_tensor(x, dtype=default_float())
+        log_likelihood = self.log_likelihood(x, Y).numpy()
+        converged = converged & np.isfinite(log_likelihood)
+        params = {name: value.numpy() for name, value in self.unpack(x).items()}
+        return log_likelihood, params, converged
+
+    def minimize(self, x0, Y, genes, maxiter):
+        # one L-BFGS-B per gene in its own thread
+        evaluator = BatchEvaluator(self.compiled_loss_and_gradient(), x0, Y, genes)
+
+        def minimize(i):
+            try:
+                return scipy.optimize.minimize(evaluator.evaluate, x0[i], args=(i,), jac=True, method='L-BFGS-B',
+                                               options=dict(maxiter=maxiter))
+            finally:
+                evaluator.finish(i)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(genes)) as executor:
+            return list(executor.map(minimize, genes))
+
+
+class BatchEvaluator(object):
+    '''
+    Loss and gradient of genes optimized from one thread each. Each optimizer waits until all genes still
+    being optimized have asked for an evaluation and the last one evaluates them together.
+    '''
+
+    def __init__(self, loss_and_gradient, x0, Y, genes):
+        self.loss_and_gradient = loss_and_gradient
+        self.x = x0.copy()  # latest position of every gene, B X P
+        self.Y = Y
+        self.active = set(genes)  # genes still being optimized
+        self.waiting = set()  # genes waiting for the next evaluation
+        self.round = 0  # evaluations of the block
+        self.loss = None  # loss and gradient of the genes of the latest evaluation
+        self.gradient = None
+        self.error = None
+        self.condition = threading.Condition()
+
+    def run(self):
+        genes = sorted(self.waiting)
+        # padded to a power of two genes, TensorFlow then meets a few shapes as the genes converge
+        rows = genes + genes[0:1] * (min(len(self.x), 2 ** int(np.ceil(np.log2(len(genes))))) - len(genes))
+        try:
+            loss, gradient = self.loss_and_gradient(tf.convert_to_tensor(self.x[rows], dtype=default_float()),
+                                                    tf.gather(self.Y, rows))
+            self.loss = dict(zip(genes, loss.numpy().astype(np.float64)))
+            self.gradient = dict(zip(genes, gradient.numpy().astype(np.float64)))
+        except Exception as error:  # e.g. the Cholesky decomposition failed, raised by the optimizer of every gene
+            self.error = error
+        self.waiting.clear()
+        self.round += 1
+        self.condition.notify_all()
+
+    def evaluate(self, x, i):
+        with self.condition:
+            if self.error is not None:
+                raise self.error
+            self.x[i] = x
+            self.waiting.add(i)
+            current = self.round
+            if self.waiting == self.active:
+                self.run()
+            while self.round == current:
+                self.condition.wait()
+            if self.error is not None:
+                raise self.error
+            return self.loss[i], self.gradient[i]
+
+    def finish(self, i):
+        with self.condition:
+            self.active.discard(i)
+            if self.waiting and self.waiting == self.active:
+                self.run()
+
+
+def gpflow_parameters(params, i):
+    '''
+    :param params: fitted constrained parameters returned by BatchedGP.fit
+    :param i: gene row
+    :return: parameters of gene i named as in gpflow.utilities.parameter_dict of the equivalent VGP or GPR
+    '''
+    values = {'.kernel.variance': params['variance'][i]}
+    if 'lengthscales' in params:
+        values['.kernel.lengthscales'] = params['lengthscales'][i]
+    if 'noise_variance' in params:
+        values['.likelihood.variance'] = params['noise_variance'][i]
+    if 'alpha' in params:
+        values['.likelihood.alpha'] = params['alpha'][i]
+    if 'km' in params:
+        values['.likelihood.km'] = params['km'][i]
+    if 'q_mu' in params:
+        values['.q_mu'] = params['q_mu'][i][:, None]
+        values['.q_sqrt'] = params['q_sqrt'][i][None, :, :]
+    return values
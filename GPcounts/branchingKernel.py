@@ -1,5 +1,4 @@
 import gpflow
-import numpy as np
 import tensorflow as tf
 from gpflow.config import default_float
 from gpflow.config import default_jitter
@@ -23,56 +22,61 @@ def plotCovarianceMatrix(covMatrix, ax, xLabel='', yLabel='', n=None, replicate_
 class BranchKernel(gpflow.kernels.Kernel):
 
     def __init__(self, base_kern, branchingPoint, noise_level=1e-6):
-        ''' branchPtTensor is tensor of branch points of size F X F X B where F the number of
-        functions and B the number of branching points '''
+        ''' branchingPoint is a scalar branching time of the two functions labelled 1 and 2 in the second input
+        column, or a tensor of branch points of size F X F X B where F the number of functions and B the number of
+        branching points, entry [i, j] holds the branch points between the functions labelled i+1 and j+1 '''
         super().__init__()
         self.kern = base_kern
-        self.xp = branchingPoint
+        self.xp = gpflow.Parameter(branchingPoint, trainable=False, dtype=default_float())
         self.noise_level = noise_level
 
-    def K(self, X, Y=None, DE=None):
-        if Y is None:
-            Y = X  # hack to avoid duplicating code below
-            square = True
-        else:
-            square = False
+    def branch_points(self):
+        # F X F X B branch points, a scalar branching time is shared by the two functions
+        if self.xp.shape.rank == 0:
+            return tf.fill([2, 2, 1], tf.convert_to_tensor(self.xp))
+        return tf.reshape(self.xp, [self.xp.shape[0], self.xp.shape[1], -1])
+
+    def cross_covariance(self, t1s, t2s, Bs):
+        # k(t1, B) k(B, B)^-1 k(B, t2) through the Cholesky factor of k(B, B)
+        kbb = self.kern.K(Bs) + tf.eye(tf.shape(Bs)[0], dtype=default_float()) * default_jitter()
+        L = tf.linalg.cholesky(kbb)  # B X B
+        A1 = tf.linalg.triangular_solve(L, self.kern.K(Bs, t1s), lower=True)  # B X N
+        A2 = tf.linalg.triangular_solve(L, self.kern.K(Bs, t2s), lower=True)  # B X M
+        return tf.linalg.matmul(A1, A2, transpose_a=True)
 
-        # if DE is None:
-        # X[np.where(X[:, 0] <= self.xp), 1] = 1
-        # Y[np.where(Y[:, 0] <= self.xp), 1] = 1
+    def K(self, X, Y=None):
+        square = Y is None
+        if square:
+            Y = X
 
-        t1s = tf.expand_dims(X[:, 0], 1)  # N X 1
-        t2s = tf.expand_dims(Y[:, 0], 1)
-        i1s = tf.expand_dims(X[:, 1], 1)
-        i2s = tf.expand_dims(Y[:, 1], 1)
+        xp = self.branch_points()
+        functions = xp.shape[0]
+        rows = [tf.where(tf.equal(X[:, 1], f + 1.))[:, 0] for f in range(functions)]
+        cols = rows if square else [tf.where(tf.equal(Y[:, 1], f + 1.))[:, 0] for f in range(functions)]
 
-        i1s_matrix = tf.tile(i1s, tf.reverse(tf.shape(i2s), [0]))
-        i2s_matrix = tf.tile(i2s, tf.reverse(tf.shape(i1s), [0]))
-        same_functions = tf.equal(i1s_matrix, tf.transpose(i2s_matrix), name='FiEQFj')
-        # i2s_matrixT = tf.transpose(i2s_matrix)
+        # every block is computed only on the inputs of its pair of functions, inputs grouped by function
+        blocks = []
+        for i in range(functions):
+            t1s = tf.gather(X[:, 0:1], rows[i])
+            row = []
+            for j in range(functions):
+                t2s = tf.gather(Y[:, 0:1], cols[j])
+                if i == j:
+                    row.append(self.kern.K(t1s, t2s))
+                else:
+                    row.append(self.cross_covariance(t1s, t2s, tf.reshape(xp[i, j], [-1, 1])))
+            blocks.append(tf.concat(row, axis=1))
+        K_s = tf.concat(blocks, axis=0)
 
-        Ktts = self.kern.K(t1s, t2s)  # N*M X N*M
-        # print(Ktts)
-        # Bs = tf.expand_dims(tf.expand_dims(self.xp, axis=0), axis=1)
-        # Bs = get_Bv([self.xp,], [0,])
-        # print(Bs)
-        Bs = np.ones((1,1)) * self.xp
-        kbb = self.kern.K(Bs) + tf.linalg.diag(tf.ones(tf.shape(Bs)[:1], dtype=default_float())) * default_jitter()
-        # print(kbb)
-        Kbbs_inv = tf.linalg.inv(kbb, name='invKbb')  # B X B
-        # print(Kbbs_inv)
-        Kb1s = self.kern.K(t1s, Bs)  # N*m X B
-        Kb2s = self.kern.K(t2s, Bs)  # N*m X B
-        a = tf.linalg.matmul(Kb1s, Kbbs_inv)
-        K_crosss = tf.linalg.matmul(a, tf.transpose(Kb2s), name='Kt1_Bi_invBB_KBt2')
-        K_s = tf.where(same_functions, Ktts, K_crosss, name='selectIndex')
+        # back to the order of the inputs, fails if a label is not one of 1..F
+        K_s = tf.gather(K_s, tf.math.invert_permutation(tf.concat(rows, axis=0)), axis=0)
+        K_s = tf.gather(K_s, tf.math.invert_permutation(tf.concat(cols, axis=0)), axis=1)
 
         if square:
-            return K_s + tf.eye(tf.shape(K_s)[0], dtype=default_float())*self.noise_level
+            return tf.linalg.set_diag(K_s, tf.linalg.diag_part(K_s) + self.noise_level)
         else:
             return K_s
 
-    def K_diag(self, X, dim=0):
+    def K_diag(self, X):
         # diagonal is just single point no branch point relevant
-        return tf.linalg.diag_part(self.kern.K(X)) + self.noise_level
-
+        return self.kern.K_diag(X[:, 0:1]) + self.noise_level
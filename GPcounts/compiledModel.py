@@ -0,0 +1,192 @@
+import time
+import numpy as np
+import scipy.optimize
+import tensorflow as tf
+import gpflow
+from gpflow.config import default_float
+from gpflow.optimizers.natgrad import (meanvarsqrt_to_expectation, expectation_to_meanvarsqrt, meanvarsqrt_to_natural,
+                                       natural_to_meanvarsqrt)
+
+
+class CompiledModel(object):
+    '''
+    GPflow model shared by all genes with the same inputs, kernel and likelihood. The counts of the
+    current gene are held in a tf.Variable and the parameters are assigned in place for every gene, so
+    the training loss and its gradient are traced once by tf.function with a fixed input signature and
+    every later fit only runs the compiled graph.
+    '''
+
+    def __init__(self, model, y, training_loss, name=''):
+        '''
+        :param model: GPflow model reading the counts from y
+        :param y: tf.Variable N X 1 holding the counts of the current gene
+        :param training_loss: closure returning the training loss of the model
+        '''
+        self.model = model
+        self.y = y
+        self.training_loss = training_loss
+        self.name = name
+        self.initial_values = gpflow.utilities.read_values(model)  # parameters before fitting any gene
+        self.variables = model.trainable_variables
+        self.sizes = [int(np.prod(variable.shape)) for variable in self.variables]
+        signature = [tf.TensorSpec([sum(self.sizes)], dtype=default_float())]
+        self.loss_and_gradient = tf.function(self.eval_loss_and_gradient, input_signature=signature)
+
+        self.fits = 0
+        self.evaluations = 0
+        self.compile_time = 0.  # tracing, compiling and running the first evaluation
+        self.run_time = 0.  # all later evaluations
+
+    def pack(self):
+        return np.concatenate([np.reshape(variable.numpy(), [-1]) for variable in self.variables])
+
+    def assign(self, x):
+        for variable, value in zip(self.variables, tf.split(x, self.sizes)):
+            variable.assign(tf.reshape(value, variable.shape))
+
+    def eval_loss_and_gradient(self, x):
+        self.assign(x)
+        with tf.GradientTape(watch_accessed_variables=False) as tape:
+            tape.watch(self.variables)
+            loss = self.training_loss()
+        gradients = tape.gradient(loss, self.variables)
+        return loss, tf.concat([tf.reshape(gradient, [-1]) for gradient in gradients], axis=0)
+
+    def evaluate(self, x):
+        start = time.perf_counter()
+        loss, gradient = self.loss_and_gradient(tf.convert_to_tensor(x, dtype=default_float()))
+        loss, gradient = loss.numpy().astype(np.float64), gradient.numpy().astype(np.float64)
+        if self.evaluations == 0:
+            self.compile_time += time.perf_counter() - start
+        else:
+            self.run_time += time.perf_counter() - start
+        self.evaluations += 1
+        return loss, gradient
+
+    def minimize(self, y, values, maxiter=5000):
+        '''
+        :param y: counts of the gene, N X 1
+        :param values: initial values of the parameters named as in gpflow.utilities.parameter_dict, the
+        parameters not given start from the values the model was built with
+        :return: scipy.optimize.OptimizeResult of L-BFGS-B, the fitted parameters are left in the model
+        '''
+        gpflow.utilities.multiple_assign(self.model, {**self.initial_values, **values})
+        self.y.assign(y)
+        self.fits += 1
+        res = scipy.optimize.minimize(self.evaluate, self.pack(), jac=True, method='L-BFGS-B',
+                                      options=dict(maxiter=maxiter))
+        self.assign(res.x)
+        return res
+
+
+class CompiledMinibatchModel(object):
+    '''
+    SVGP shared by all genes with the same number of cells, inducing points, kernel and likelihood and trained on
+    mini-batches of cells. The parameters are assigned in place for every gene, so the update, a natural gradient step
+    on the variational parameters followed by an Adam step on the hyper-parameters, is traced once by tf.function with
+    a fixed input signature. The natural gradient step is written with the parameter conversions of
+    gpflow.optimizers.natgrad rather than the NaturalGradient optimizer, which needs the TensorFlow optimizer base
+    class of the GPflow release it was written for.
+    '''
+
+    def __init__(self, model, minibatch_size, learning_rate, gamma, name=''):
+        '''
+        :param model: gpflow.models.SVGP
+        :param minibatch_size: cells per update
+        :param learning_rate: Adam learning rate of the hyper-parameters
+        :param gamma: natural gradient step of the variational parameters
+        '''
+        self.model = model
+        self.minibatch_size = minibatch_size
+        self.gamma = gamma
+        self.name = name
+        self.initial_values = gpflow.utilities.read_values(model)  # parameters before fitting any gene
+        variational = [model.q_mu.unconstrained_variable.ref(), model.q_sqrt.unconstrained_variable.ref()]
+        self.hyper_variables = [variable for variable in model.trainable_variables if variable.ref() not in variational]
+        self.adam = tf.optimizers.Adam(learning_rate)
+        input_dim = model.inducing_variable.Z.shape[1]
+        signature = [tf.TensorSpec([minibatch_size, input_dim], dtype=default_float()),
+                     tf.TensorSpec([minibatch_size, 1], dtype=default_float())]
+        self.step = tf.function(self.eval_step, input_signature=signature)
+        self.fits = 0
+
+    def natgrad_step(self, data):
+        q_mu, q_sqrt = self.model.q_mu, self.model.q_sqrt
+        variables = [q_mu.unconstrained_variable, q_sqrt.unconstrained_variable]
+        with tf.GradientTape(watch_accessed_variables=False) as tape:
+            tape.watch(variables)
+            loss = self.model.training_loss(data)
+        gradients = tape.gradient(loss, variables)
+        # gradients of the constrained mean and Cholesky factor of q(u)
+        gradients = [gradient if parameter.transform is None else parameter.transform.forward(gradient)
+                     for gradient, parameter in zip(gradients, [q_mu, q_sqrt])]
+
+        # the natural gradient is the gradient with respect to the expectation parameters
+        with tf.GradientTape(watch_accessed_variables=False) as tape:
+            tape.watch(variables)
+            eta1, eta2 = meanvarsqrt_to_expectation(q_mu, q_sqrt)
+            meanvarsqrt = expectation_to_meanvarsqrt(eta1, eta2)
+        dL_deta1, dL_deta2 = tape.gradient(meanvarsqrt, [eta1, eta2], output_gradients=gradients)
+
+        nat1, nat2 = meanvarsqrt_to_natural(q_mu, q_sqrt)
+        mean, varsqrt = natural_to_meanvarsqrt(nat1 - self.gamma * dL_deta1, nat2 - self.gamma * dL_deta2)
+        q_mu.assign(mean)
+        q_sqrt.assign(varsqrt)
+
+    def eval_step(self, X, y):
+        self.natgrad_step((X, y))
+        with tf.GradientTape(watch_accessed_variables=False) as tape:
+            tape.watch(self.hyper_variables)
+            loss = self.model.training_loss((X, y))
+        self.adam.apply_gradients(zip(tape.gradient(loss, self.hyper_variables), self.hyper_variables))
+        return loss
+
+    def reset_optimizer(self):
+        variables = self.adam.variables() if callable(self.adam.variables) else self.adam.variables
+        for variable in variables:
+            variable.assign(tf.zeros_like(variable))
+
+    def batches(self, N, seed):
+        # shuffled cells, every epoch is a new permutation and batches run across epochs so they keep the same size
+        rng = np.random.default_rng(seed)
+        cells = np.empty(0, dtype=int)
+        while True:
+            while len(cells) < self.minibatch_size:
+                cells = np.concatenate([cells, rng.permutation(N)])
+            yield cells[0:self.minibatch_size]
+            cells = cells[self.minibatch_size:]
+
+    def minimize(self, X, y, values, options, seed=0):
+        '''
+        Train on shuffled mini-batches until the loss averaged over a window of updates stops changing
+        :param X: inputs of the gene, N X D
+        :param y: counts of the gene, N X 1
+        :param values: initial values of the parameters named as in gpflow.utilities.parameter_dict
+        :param options: 'maxiter', 'window' and 'tolerance' of the stochastic training
+        :return: scipy.optimize.OptimizeResult with the full data training loss, success when it is finite
+        '''
+        gpflow.utilities.multiple_assign(self.model, {**self.initial_values, **values})
+        self.reset_optimizer()
+        self.fits += 1
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        batches = self.batches(len(X), seed)
+
+        previous_loss = None
+        nit = 0
+        while nit < options['maxiter']:
+            window_loss = 0.
+            for _ in range(options['window']):
+                cells = next(batches)
+                window_loss += self.step(tf.constant(X[cells]), tf.constant(y[cells])).numpy()
+            window_loss /= options['window']
+            nit += options['window']
+            if not np.isfinite(window_loss):
+                break
+            if previous_loss is not None and abs(window_loss - previous_loss) < options['tolerance'] * abs(window_loss):
+                break
+            previous_loss = window_loss
+
+        # the loss on all cells keeps the log likelihood comparable with full data fitting
+        loss = self.model.training_loss((X, y)).numpy()
+        return scipy.optimize.OptimizeResult(fun=loss, nit=nit, success=np.isfinite(loss))
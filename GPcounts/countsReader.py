@@ -0,0 +1,91 @@
+import io
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+
+class CountsReader(object):
+    '''
+    Lazy reader of a genes X cells counts matrix stored in a file, for matrices that do not fit in memory.
+    Supported files are CSV with genes names in the first column and cells names in the header (as
+    read by pd.read_csv(path,index_col=[0])), numpy .npy opened as a memory map and scipy sparse .npz.
+    Genes are read in chunks of chunk_size rows converted to float64, kept as CSR for sparse files, so only the current chunk is
+    held in memory.
+    '''
+
+    def __init__(self, path, chunk_size=1000, genes_name=None):
+        self.path = str(path)
+        self.chunk_size = chunk_size
+        self.matrix = None  # memory map or sparse matrix, opened on first use
+        self.offsets = None  # byte offset of the first line of every chunk of a CSV file
+
+        if self.path.endswith('.csv'):
+            self.format = 'csv'
+            self.genes_name = self.scan_csv()
+            D, N = len(self.genes_name), len(self.cells_name)
+        elif self.path.endswith('.npy'):
+            self.format = 'npy'
+            D, N = self.open().shape
+        elif self.path.endswith('.npz'):
+            self.format = 'sparse'
+            D, N = self.open().shape
+        else:
+            raise ValueError('Counts file should be a .csv, .npy or sparse .npz file: %s' % self.path)
+
+        if self.format != 'csv':
+            self.cells_name = None
+            self.genes_name = list(genes_name) if genes_name is not None else ['gene_%d' % i for i in range(D)]
+        self.shape = (D, N)
+
+    def __getstate__(self):
+        # every process opens its own memory map
+        state = self.__dict__.copy()
+        state['matrix'] = None
+        return state
+
+    def scan_csv(self):
+        # one pass over the lines to get the genes names and where every chunk starts
+        genes_name = []
+        self.offsets = []
+        with open(self.path, 'rb') as f:
+            header = f.readline()
+            self.cells_name = pd.read_csv(io.StringIO(header.decode()), index_col=[0]).columns.values
+            offset = f.tell()
+            for line in iter(f.readline, b''):
+                if len(genes_name) % self.chunk_size == 0:
+                    self.offsets.append(offset)
+                genes_name.append(line.split(b',', 1)[0].decode().strip('"'))
+                offset = f.tell()
+        return genes_name
+
+    def open(self):
+        if self.matrix is None:
+            if self.format == 'npy':
+                self.matrix = np.load(self.path, mmap_mode='r')
+            else:
+                self.matrix = scipy.sparse.load_npz(self.path).tocsr()
+        return self.matrix
+
+    def read_chunk(self, chunk):
+        start = chunk * self.chunk_size
+        stop = min(start + self.chunk_size, self.shape[0])
+        if self.format == 'csv':
+            with open(self.path, 'rb') as f:
+                f.seek(self.offsets[chunk])
+                counts = pd.read_csv(f, header=None, index_col=[0], nrows=stop - start)
+            return counts.to_numpy(dtype=float)
+        if self.format == 'npy':
+            return np.array(self.open()[start:stop], dtype=float)
+        return self.open()[start:stop].astype(float)
+
+    def chunk_of(self, index):
+        '''
+        :param index: gene index
+        :return: index of the first gene of the chunk holding the gene and the chunk counts, chunk_size X N
+        '''
+        chunk = index // self.chunk_size
+        return chunk * self.chunk_size, self.read_chunk(chunk)
+
+    def chunks(self):
+        for chunk in range(int(np.ceil(self.shape[0] / self.chunk_size))):
+            yield chunk * self.chunk_size, self.read_chunk(chunk)
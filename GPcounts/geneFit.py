@@ -0,0 +1,535 @@
+'''
+Fit of the GP of one gene without the Fit_GPcounts object.
+
+fit_gene(x, y, likelihood, kernel_spec, init, seed) builds the model, optimizes it with random restarts on failures
+and returns a FitResult. Random restarts and posterior samples are drawn from generators seeded by the call and no
+global TensorFlow or GPflow setting is changed, so genes can be fitted from threads, processes or any other executor.
+Three caches of the options are shared between the calls given them: the kernel cache, which is locked, and the
+compiled and mini-batch models caches, which hold one model per inputs that every fit assigns in place and should not
+be shared between threads. The fitted parameters are copied to a model of the gene, so a FitResult is never changed by
+later fits.
+'''
+
+import time
+import numpy as np
+import tensorflow as tf
+import gpflow
+from gpflow.utilities import set_trainable
+from scipy.signal import savgol_filter
+from GPcounts import branchingKernel
+from GPcounts import NegativeBinomialLikelihood
+from GPcounts import kernelCache
+from GPcounts import compiledModel
+from .utilities import fingerprint
+
+Default_options = {
+    'safe_mode': False, # restart fits with positive log likelihood and check the predictive mean for local optima
+    'transform': True, # use log(count+1) transformation with the Gaussian likelihood
+    'nb_scaled': False, # scale the negative binomial mean by the library size
+    'scale': None, # library size scale of the gene when nb_scaled
+    'zero_split': False, # zero_split of the NB and ZINB likelihoods
+    'minibatch_size': None, # cells per mini-batch to train sparse non Gaussian models stochastically, None for L-BFGS
+    'minibatch_options': {'maxiter':20000,'learning_rate':0.01,'gamma':0.1,'window':100,'tolerance':1e-4},
+    'minibatch_models': None, # dict of compiledModel.CompiledMinibatchModel refitted in place for every gene
+    'local_optima_check': 'sampling', # check of the predictive mean from posterior predictive 'sampling' or 'analytic'
+    'f_samples_number': 100, # latent GP samples drawn for the posterior predictive distribution
+    'y_samples_number': 500, # counts sampled per test point and round of five latent samples
+    'kernel_cache': None, # kernelCache.KernelCache shared by genes with the same inputs
+    'compiled_models': None, # dict of compiledModel.CompiledModel refitted in place for every gene, None to build models
+    'maxiter': 5000 # L-BFGS-B iterations
+}
+
+Minimum_hyper_parameter = 1e-6 # fitted hyper-parameters below are at the boundary of their positive range
+
+Stats = ['optimize_time','nit','cholesky_failures','optimization_failures','local_optima_restarts',
+         'positive_likelihood_restarts','local_optima_time']
+
+
+class FitResult(object):
+    '''
+    Outcome of fit_gene
+    '''
+
+    def __init__(self, log_likelihood, model, seed, restarts, stats):
+        self.log_likelihood = log_likelihood # log posterior density of the model, nan when the fit failed
+        self.model = model # fitted GPflow model, None when the fit failed
+        self.seed = seed # seed of the last random restart, the seed of fit_gene without restarts
+        self.restarts = restarts # number of random restarts
+        self.stats = stats # time and iterations of the optimizer, failures and restarts by cause
+
+    @property
+    def success(self):
+        return not np.isnan(self.log_likelihood)
+
+
+def fit_gene(x, y, likelihood, kernel_spec, init, seed=0, Z=None, options=None):
+    '''
+    :param x: inputs N X D
+    :param y: counts of the gene N X 1, log transformed here for the Gaussian likelihood
+    :param likelihood: 'Negative_binomial', 'Zero_inflated_negative_binomial', 'Poisson' or 'Gaussian'
+    :param kernel_spec: 'RBF', 'Constant' or a dict with the kernel 'name' and for the 'Branching' kernel the branching
+    time 'xp' and optionally the fixed 'variance' and 'lengthscales' of its RBF kernel
+    :param init: initial hyper-parameters 'ls', 'var', 'alpha' and 'km', see initial_hyper_parameters
+    :param seed: seed of the first fit, every random restart adds one and samples the hyper-parameters uniformly
+    :param Z: inducing points of a sparse GP, None for a full GP
+    :param options: dict overriding Default_options
+    :return: FitResult
+    '''
+    fit = _GeneFit(x, y, likelihood, kernel_spec, init, seed, Z, options)
+    log_likelihood = fit.fit_model()
+    return FitResult(log_likelihood, fit.model, fit.seed, fit.restarts, fit.stats)
+
+
+def fit_options(options=None):
+    return dict(Default_options) if options is None else {**Default_options, **options}
+
+
+def initial_hyper_parameters(x, y, likelihood, transform=True, length_scale=None, variance=None, alpha=None, km=None):
+    '''
+    :return: user given hyper-parameters, the others set from the range of the inputs and the counts of the gene
+    '''
+    if length_scale is None:
+        length_scale = (5*(np.max(x)-np.min(x)))/100
+
+    if variance is None:
+        if likelihood == 'Gaussian' and not transform:
+            variance = np.mean(y+1**2)
+        else:
+            variance = np.mean(np.log(y+1)**2)
+
+    return {'ls':length_scale,'var':variance,'alpha':1. if alpha is None else alpha,'km':35. if km is None else km}
+
+
+def hyper_parameters_ranges(x):
+    '''
+    :return: (low, high) of every hyper-parameter, the uniform distributions random restarts sample from
+    '''
+    span = np.max(x)-np.min(x)
+    return {'ls':((.25*span)/100,(30.*span)/100),'var':(0.,10.),'alpha':(0.,10.),'km':(0.,100.)}
+
+
+def get_kernel_spec(kernel_spec):
+    if isinstance(kernel_spec, str):
+        return {'name':kernel_spec}
+    return kernel_spec
+
+
+# RBF, constant or branching kernel
+def get_kernel(kernel_spec, hyper_parameters):
+    kernel_spec = get_kernel_spec(kernel_spec)
+    if kernel_spec['name'] == 'Branching':
+        if kernel_spec.get('variance') is not None:
+            kern = gpflow.kernels.RBF(variance=kernel_spec['variance'], lengthscales=kernel_spec['lengthscales'])
+            set_trainable(kern.lengthscales,False)
+            set_trainable(kern.variance,False)
+        else:
+            kern = gpflow.kernels.RBF()
+        return branchingKernel.BranchKernel(kern,kernel_spec['xp'])
+
+    if kernel_spec['name'] == 'Constant':
+        return gpflow.kernels.Constant(variance= hyper_parameters['var'])
+    return gpflow.kernels.RBF(variance= hyper_parameters['var'],lengthscales = hyper_parameters['ls'])
+
+
+def get_likelihood(likelihood, alpha, km, options=None):
+    options = fit_options(options)
+    if likelihood == 'Poisson':
+        return gpflow.likelihoods.Poisson()
+
+    if likelihood == 'Negative_binomial':
+        # library size scaling
+        if options['nb_scaled']:
+            return NegativeBinomialLikelihood.NegativeBinomial(alpha,scale=options['scale'],nb_scaled=True)
+        return NegativeBinomialLikelihood.NegativeBinomial(alpha,nb_scaled=False,zero_split=options['zero_split'])
+
+    if likelihood == 'Zero_inflated_negative_binomial':
+        return NegativeBinomialLikelihood.ZeroInflatedNegativeBinomial(alpha,km,zero_split=options['zero_split'])
+    return None
+
+
+def build_model(kernel, likelihood, lik_name, X, y, Z=None, constant=False, kernel_cache=None):
+    '''
+    Build GPR, SGPR, VGP or SVGP on data (X,y), sparse when inducing points Z are given
+    :param constant: constant model of the one sample test, its inducing points are not trained
+    :return: the model and its training loss
+    '''
+    if lik_name == 'Gaussian':
+        if Z is not None:
+            if kernel_cache is None:
+                model = gpflow.models.SGPR((X,y), kernel=kernel,inducing_variable=Z)
+            else:
+                model = kernelCache.CachedSGPR((X,y), kernel=kernel,inducing_variable=Z,kernel_cache=kernel_cache)
+        elif kernel_cache is None:
+            model = gpflow.models.GPR((X,y), kernel)
+        else:
+            model = kernelCache.CachedGPR((X,y), kernel,kernel_cache=kernel_cache)
+        training_loss = model.training_loss
+
+    elif Z is not None:
+        model = gpflow.models.SVGP(kernel,likelihood,Z,num_data = len(X))
+        training_loss = model.training_loss_closure((X, y))
+
+    else:
+        if kernel_cache is None:
+            model = gpflow.models.VGP((X, y), kernel, likelihood)
+        else:
+            model = kernelCache.CachedVGP((X, y), kernel, likelihood,kernel_cache=kernel_cache)
+        training_loss = model.training_loss
+
+    if Z is not None and constant:
+        set_trainable(model.inducing_variable.Z,False)
+    return model,training_loss
+
+
+def restore_model(X, y, likelihood, kernel_spec='RBF', params=None, file_name=None, Z=None, options=None):
+    '''
+    Build the model of a gene from saved parameters, nothing is optimized or sampled
+    :param y: counts of the gene, log transformed here for the Gaussian likelihood
+    :param params: parameters from gpflow.utilities.parameter_dict, the kernel and sparse or full model are read from
+    their names
+    :param file_name: checkpoint of the model built with kernel_spec and inducing points Z
+    :return: the restored GPflow model
+    '''
+    options = fit_options(options)
+    if params is not None:
+        if '.kernel.kern.variance' in params:
+            kernel_spec = {'name':'Branching','xp':params['.kernel.xp']}
+        elif '.kernel.lengthscales' in params:
+            kernel_spec = 'RBF'
+        else:
+            kernel_spec = 'Constant'
+        Z = params.get('.inducing_variable.Z')
+
+    kernel_spec = get_kernel_spec(kernel_spec)
+    if kernel_spec['name'] == 'Branching':
+        kernel = branchingKernel.BranchKernel(gpflow.kernels.RBF(),kernel_spec['xp'])
+    elif kernel_spec['name'] == 'Constant':
+        kernel = gpflow.kernels.Constant()
+    else:
+        kernel = gpflow.kernels.RBF()
+
+    if likelihood == 'Gaussian' and options['transform']:
+        y = np.log(y+1)
+    # restored models are used for predictions of single genes, which do not share kernel matrices
+    model,_ = build_model(kernel,get_likelihood(likelihood,1.,35.,options),likelihood,X,y,Z,
+                          kernel_spec['name'] == 'Constant')
+
+    if params is not None:
+        gpflow.utilities.multiple_assign(model,params)
+    else:
+        ckpt = tf.train.Checkpoint(model=model, step=tf.Variable(1))
+        ckpt.restore(file_name)
+    return model
+
+
+# SVGP trained on mini-batches, compiled once per number of cells, inducing points, kernel and likelihood when a cache is
+# given and built for this fit otherwise
+def get_minibatch_model(minibatch_models, X, y, Z, likelihood, constant, hyper_parameters, options):
+    minibatch_size = min(options['minibatch_size'],len(X))
+    minibatch_options = options['minibatch_options']
+    key = (len(X),X.shape[1],len(Z),likelihood,constant,options['zero_split'],minibatch_size,
+           minibatch_options['learning_rate'],minibatch_options['gamma'])
+
+    if minibatch_models is None or key not in minibatch_models:
+        kernel = get_kernel('Constant' if constant else 'RBF',hyper_parameters)
+        lik = get_likelihood(likelihood,hyper_parameters['alpha'],hyper_parameters['km'],options)
+        model,_ = build_model(kernel,lik,likelihood,X,y,Z,constant)
+        name = '_'.join([likelihood,'Constant' if constant else 'RBF','minibatch',str(minibatch_size),str(len(X))])
+        minibatch_model = compiledModel.CompiledMinibatchModel(model,minibatch_size,minibatch_options['learning_rate'],
+                                                               minibatch_options['gamma'],name = name)
+        if minibatch_models is None:
+            return minibatch_model
+        minibatch_models[key] = minibatch_model
+    return minibatch_models[key]
+
+
+# model of the inputs, kernel and likelihood compiled once and refitted in place for every gene
+def get_compiled_model(compiled_models, X, y, Z, likelihood, constant, hyper_parameters, options):
+    key = (fingerprint(X),None if Z is None else fingerprint(Z),likelihood,constant,options['zero_split'])
+
+    if key not in compiled_models:
+        kernel = get_kernel('Constant' if constant else 'RBF',hyper_parameters)
+        lik = get_likelihood(likelihood,hyper_parameters['alpha'],hyper_parameters['km'],options)
+        model,_ = build_model(kernel,lik,likelihood,X,y,Z,constant,options['kernel_cache'])
+
+        # the model reads the counts of every gene from y
+        y = tf.Variable(y,dtype = gpflow.config.default_float(),trainable = False)
+        data = (tf.convert_to_tensor(X,dtype = gpflow.config.default_float()),y)
+        if Z is not None and likelihood != 'Gaussian':
+            training_loss = lambda: model.training_loss(data)
+        else:
+            model.data = data
+            training_loss = model.training_loss
+
+        name = '_'.join([str(len(compiled_models)),likelihood,'Constant' if constant else 'RBF',
+                         'sparse' if Z is not None else 'full',str(len(X))])
+        compiled_models[key] = compiledModel.CompiledModel(model,y,training_loss,name = name)
+    return compiled_models[key]
+
+
+# initial values of the hyper-parameters as paths of gpflow.utilities.parameter_dict
+def initial_parameters(hyper_parameters, likelihood, constant):
+    values = {'.kernel.variance':hyper_parameters['var']}
+    if not constant:
+        values['.kernel.lengthscales'] = hyper_parameters['ls']
+    if likelihood in ['Negative_binomial','Zero_inflated_negative_binomial']:
+        values['.likelihood.alpha'] = hyper_parameters['alpha']
+    if likelihood == 'Zero_inflated_negative_binomial':
+        values['.likelihood.km'] = hyper_parameters['km']
+    return values
+
+
+def generate_samples(model, likelihood, mean, samples_number, rng):
+    """
+    :param mean: mean of the counts distribution at each test point, array of any shape
+    :return: samples from the likelihood of the model of shape (samples_number,) + mean.shape
+    """
+    mean = np.asarray(mean)
+    size = (samples_number,) + mean.shape
+
+    if likelihood == 'Poisson' or (likelihood == 'Negative_binomial' and model.likelihood.alpha.numpy() == 0):
+        return rng.poisson(mean, size = size).astype(float)
+
+    r = 1./model.likelihood.alpha.numpy()  # r  number of failures
+    prob = r / (mean+ r)   # p probability of success
+    y = rng.negative_binomial(r, prob, size = size).astype(float)
+
+    if likelihood == 'Zero_inflated_negative_binomial':
+        km = model.likelihood.km.numpy() # Michaelin-Menten (MM) constant
+        psi = 1.- (mean/(km+mean)) # psi probability of zeros
+        # one Bernoulli draw per test point zeroes all its samples
+        y = y * (rng.random(mean.shape) < 1.-psi)
+    return y
+
+
+def latent_samples(model, xtest, samples_number, seed=0):
+    '''
+    :return: samples_number X N X 1 samples of the latent GP at xtest as predict_f_samples, drawn from a generator
+    seeded with seed instead of the global TensorFlow seed
+    '''
+    mean,cov = model.predict_f(xtest, full_cov=True) # N X 1, 1 X N X N
+    jitter = tf.eye(tf.shape(cov)[-1],dtype = cov.dtype)*gpflow.config.default_jitter()
+    eps = tf.random.Generator.from_seed(seed).normal([cov.shape[0],cov.shape[-1],samples_number],dtype = cov.dtype)
+    samples = tf.transpose(mean)[:,:,None]+tf.linalg.matmul(tf.linalg.cholesky(cov+jitter),eps) # 1 X N X S
+    return tf.transpose(samples,[2,1,0]).numpy()
+
+
+def samples_posterior_predictive_distribution(model, likelihood, xtest, seed=0, f_samples_number=100,
+                                              y_samples_number=500, branching=False):
+    '''
+    :return: mean of the posterior predictive distribution at xtest, smoothed unless branching, and counts sampled
+    from it, latent and counts samples are drawn from generators seeded with seed
+    '''
+    rng = np.random.default_rng(seed)
+    rounds = max(1,f_samples_number//5)
+    f = latent_samples(model, xtest, 5*rounds, seed)
+    link_f = np.exp(f[:, :, 0])
+
+    # mean of the first 5, 10, ... latent samples, one counts distribution per round of five samples
+    round_means = np.cumsum(link_f,axis = 0)[4::5]/np.arange(5,5*rounds+1,5)[:,None]
+    var = generate_samples(model,likelihood,round_means,y_samples_number,rng)
+    var = np.swapaxes(var,0,1).reshape([-1,xtest.shape[0]])
+
+    if branching:
+        mean = np.mean(link_f, axis=0)
+    else:
+        mean = savgol_filter(np.mean(var,axis = 0), int(xtest.shape[0]/2)+1, 3)
+        mean = np.maximum(mean,0.)
+    return mean,var
+
+
+def predictive_mean_and_var(model, likelihood, xtest):
+    """
+    :return: mean and variance of the counts at xtest under the posterior predictive distribution, from the log-normal
+    moments E[exp(f)] = exp(mu+var/2) and E[exp(2f)] = exp(2mu+2var) of the latent GP for Poisson and negative binomial
+    and by Gauss-Hermite quadrature for the zero inflated negative binomial
+    """
+    mu,var = model.predict_f(xtest)
+    if likelihood == 'Zero_inflated_negative_binomial':
+        mean,var = model.likelihood.predict_mean_and_var(mu,var)
+        return mean.numpy(),var.numpy()
+
+    mu,var = mu.numpy(),var.numpy()
+    alpha = 0. if likelihood == 'Poisson' else model.likelihood.alpha.numpy()
+    m1 = np.exp(mu+var/2.)
+    m2 = np.exp(2.*mu+2.*var)
+    # Var[y] = E[Var[y|f]]+Var[E[y|f]] with Var[y|f] = m+alpha*m^2
+    return m1,m1+(1.+alpha)*m2-m1**2
+
+
+class _GeneFit(object):
+    '''
+    State of one call of fit_gene: the model being fitted, the seed and the number of restarts
+    '''
+
+    def __init__(self, x, y, likelihood, kernel_spec, init, seed, Z, options):
+        self.x = np.asarray(x,dtype = np.float64)
+        self.counts = np.asarray(y,dtype = np.float64)
+        self.lik_name = likelihood
+        self.kernel_spec = get_kernel_spec(kernel_spec)
+        self.constant = self.kernel_spec['name'] == 'Constant'
+        self.branching = self.kernel_spec['name'] == 'Branching'
+        self.init = init
+        self.Z = Z
+        self.options = fit_options(options)
+
+        self.seed = seed
+        self.count_fix = 0 # counter of number of trails to resolve either local optima or failure duo to numerical issues
+        self.restarts = 0
+        self.stats = dict.fromkeys(Stats,0)
+        self.hyper_parameters = None
+        self.model = None
+        self.y = None
+
+    # Hyper-parameters initialization or resetting in case of failure
+    def init_hyper_parameters(self, reset=False):
+        if reset:
+            # in case of failure change the seed and sample hyper-parameters from uniform distributions
+            self.count_fix = self.count_fix +1
+            self.restarts = self.restarts + 1
+            self.seed = self.seed + 1
+            rng = np.random.RandomState(self.seed)
+            ranges = hyper_parameters_ranges(self.x)
+            self.hyper_parameters = {name:rng.uniform(*ranges[name]) for name in ['ls','var','alpha','km']}
+        else:
+            self.hyper_parameters = dict(self.init)
+        if self.constant:
+            self.hyper_parameters['ls'] = -1.
+
+        # use log(count+1) in case of Gaussian likelihood and transform
+        if self.lik_name == 'Gaussian' and self.options['transform']:
+            self.y = np.log(self.counts+1)
+        else:
+            self.y = self.counts
+        self.model = None
+
+    # log likelihood of a successful fit, nan in case of failure
+    def fit_model(self, reset=False):
+        fit = self.fit_GP(reset)
+        if fit:
+            if self.Z is not None and self.lik_name != 'Gaussian':
+                log_likelihood = self.model.log_posterior_density((self.x,self.y)).numpy()
+            else:
+                log_likelihood = self.model.log_posterior_density().numpy()
+
+            # fix positive likelihood by random restart
+            if log_likelihood > 0 and self.count_fix < 10 and self.options['safe_mode'] and self.lik_name != 'Gaussian':
+                self.count_fix = self.count_fix + 1
+                self.stats['positive_likelihood_restarts'] += 1
+                log_likelihood = self.fit_model(True)
+        else: # Cholesky decomposition or optimization failure
+            log_likelihood = np.nan
+            self.model = None
+        return log_likelihood
+
+    def fit_GP(self, reset=False):
+        self.init_hyper_parameters(reset)
+
+        fit = True
+        try:
+            fit = self.fit_GP_with_likelihood()
+
+        except tf.errors.InvalidArgumentError:
+            self.stats['cholesky_failures'] += 1
+            if self.count_fix < 10: # fix failure by random restart
+                fit = self.fit_GP(True)
+            else:
+                print('Can not fit a Gaussian process, Cholesky decomposition was not successful.')
+                fit = False
+
+        if fit and self.count_fix < 5 and not self.branching and self.options['safe_mode']:
+            self.test_local_optima_case1()
+        return fit
+
+    # Fit a GP with selected kernel and likelihood, run it as sparse or full GP
+    def fit_GP_with_likelihood(self):
+        options = self.options
+        fit = True
+
+        start = time.perf_counter()
+        if options['minibatch_size'] is not None and self.Z is not None and self.lik_name != 'Gaussian':
+            minibatch_model = get_minibatch_model(options['minibatch_models'],self.x,self.y,self.Z,self.lik_name,
+                                                  self.constant,self.hyper_parameters,options)
+            values = {**initial_parameters(self.hyper_parameters,self.lik_name,self.constant),
+                      '.inducing_variable.Z':self.Z}
+            res = minibatch_model.minimize(self.x,self.y,values,options['minibatch_options'],self.seed)
+            self.model = self.copy_model(minibatch_model.model)
+        elif options['compiled_models'] is not None and not self.branching and not options['nb_scaled']:
+            compiled_model = get_compiled_model(options['compiled_models'],self.x,self.y,self.Z,self.lik_name,
+                                                self.constant,self.hyper_parameters,options)
+            res = compiled_model.minimize(self.y,initial_parameters(self.hyper_parameters,self.lik_name,self.constant),
+                                          maxiter=options['maxiter'])
+            self.model = self.copy_model(compiled_model.model)
+        else:
+            self.model,training_loss = self.build_model()
+            o = gpflow.optimizers.Scipy()
+            res = o.minimize(training_loss, variables=self.model.trainable_variables,
+                             options=dict(maxiter=options['maxiter']))
+
+        self.stats['optimize_time'] += time.perf_counter()-start
+        self.stats['nit'] += res.nit
+        if not(res.success): # test if optimization fail
+            self.stats['optimization_failures'] += 1
+            if self.count_fix < 10: # fix failure by random restart
+                fit = self.fit_GP(True)
+            else:
+                print('Can not Optimaize a Gaussian process, Optimization fail.')
+                fit = False
+        return fit
+
+    def build_model(self):
+        kernel = get_kernel(self.kernel_spec,self.hyper_parameters)
+        likelihood = get_likelihood(self.lik_name,self.hyper_parameters['alpha'],self.hyper_parameters['km'],
+                                    self.options)
+        return build_model(kernel,likelihood,self.lik_name,self.x,self.y,self.Z,self.constant,
+                           self.options['kernel_cache'])
+
+    # model of this gene holding the parameters fitted in a shared model, which the next gene refits in place
+    def copy_model(self, shared_model):
+        model,_ = self.build_model()
+        parameters = gpflow.utilities.parameter_dict(model)
+        values = gpflow.utilities.read_values(shared_model)
+        gpflow.utilities.multiple_assign(model,{path:values[path] for path in parameters})
+        return model
+
+    def test_local_optima_case1(self):
+        options = self.options
+        x = self.x if self.Z is None else self.Z
+        if self.x.shape[1] == 1:
+            xtest = np.linspace(np.min(x),np.max(x),100)[:,None]
+        else:
+            xtest = self.x
+
+        start = time.perf_counter()
+        if self.lik_name == 'Gaussian':
+            mean,_ = self.model.predict_y(xtest)
+            mean = mean.numpy()
+        elif options['local_optima_check'] == 'analytic' and not options['nb_scaled']:
+            mean,_ = predictive_mean_and_var(self.model,self.lik_name,xtest)
+        else:
+            # mean of posterior predictive samples
+            mean,_ = samples_posterior_predictive_distribution(self.model,self.lik_name,xtest,self.seed,
+                                                               options['f_samples_number'],options['y_samples_number'])
+        self.stats['local_optima_time'] += time.perf_counter()-start
+
+        y_max = np.max(self.y)
+        mean_max = np.max(mean)
+        y_min = np.min(self.y)
+        mean_min = np.min(mean)
+        y_mean = np.mean(self.y)
+        mean_mean = np.mean(mean)
+
+        if len(self.x) < 100:
+            diff = 0
+        else:
+            diff = 1
+        if self.constant:
+            if mean_min < y_min or mean_max > y_max or mean_mean == 0.0:
+                self.stats['local_optima_restarts'] += 1
+                self.fit_GP(True)
+
+        if y_mean > 0.0:
+            diff_mean = abs(round((mean_mean-y_mean)/y_mean))
+            if diff_mean > diff and mean_min < y_min or diff_mean > diff and mean_max > y_max or mean_mean == 0.0:
+                self.stats['local_optima_restarts'] += 1
+                self.fit_GP(True)
@@ -0,0 +1,72 @@
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+
+def kmeans(X, M):
+    return KMeans(n_clusters=M).fit(X).cluster_centers_
+
+
+def minibatch_kmeans(X, M):
+    return MiniBatchKMeans(n_clusters=M, batch_size=max(1024, 3 * M)).fit(X).cluster_centers_
+
+
+def quantile(X, M):
+    # evenly spaced quantiles of a single input dimension such as pseudotime
+    return np.quantile(X[:, 0], (np.arange(M) + 0.5) / M)[:, None]
+
+
+def greedy_variance(X, M, lengthscale):
+    '''
+    Greedy selection of the inputs with the largest variance conditioned on the inputs already selected under
+    an RBF kernel with unit variance, an incremental pivoted Cholesky decomposition of cost O(N M^2)
+    '''
+    variance = np.ones(X.shape[0])
+    L = np.zeros((M, X.shape[0]))
+    selected = []
+    for m in range(M):
+        i = int(np.argmax(variance))
+        if variance[i] <= 1e-12:  # the remaining inputs are already explained by the selected ones
+            break
+        selected.append(i)
+        k = np.exp(-0.5 * np.sum((X - X[i]) ** 2, axis=1) / lengthscale ** 2)
+        L[m] = (k - L[:m].T.dot(L[:m, i])) / np.sqrt(variance[i])
+        variance = np.maximum(variance - L[m] ** 2, 0.)
+    return X[selected]
+
+
+def distinct_points(Z, tolerance):
+    '''
+    :return: sorted points of Z without the points closer than tolerance to a point kept before them
+    '''
+    Z = np.unique(Z, axis=0)
+    keep = [0]
+    for i in range(1, len(Z)):
+        if np.min(np.max(np.abs(Z[keep] - Z[i]), axis=1)) > tolerance:
+            keep.append(i)
+    return Z[keep]
+
+
+def select_inducing_points(X, M, method='kmeans'):
+    '''
+    :param X: inputs N X D
+    :param M: number of inducing points, fewer are returned when the inputs have repeated values
+    :param method: 'kmeans', 'minibatch_kmeans', 'quantile' for one input dimension or 'greedy_variance'
+    :return: distinct inducing points M X D, sorted
+    '''
+    if method == 'kmeans':
+        Z = kmeans(X, M)
+    elif method == 'minibatch_kmeans':
+        Z = minibatch_kmeans(X, M)
+    elif method == 'quantile' and X.shape[1] == 1:
+        Z = quantile(X, M)
+    elif method == 'quantile':
+        print('Quantile inducing points need one input dimension, inducing points are set by K-means.')
+        Z = kmeans(X, M)
+    elif method == 'greedy_variance':
+        # same length scale as the default initialization of the RBF kernel
+        Z = greedy_variance(X, M, (5 * (np.max(X) - np.min(X))) / 100)
+    else:
+        raise ValueError('Unknown inducing points method: %s' % method)
+
+    # K-means repeats centres on replicated inputs, repeated inducing points make Kuu singular
+    return distinct_points(Z, 1e-6 * max(np.max(X) - np.min(X), 1.))
@@ -0,0 +1,197 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import tensorflow as tf
+import gpflow
+from gpflow.config import default_float, default_jitter
+from gpflow.logdensities import multivariate_normal
+from .utilities import fingerprint
+
+
+def kernel_key(kernel):
+    '''
+    Kernel type and parameter values, including the branching time of BranchKernel, part of the key of every cached matrix
+    '''
+    key = [type(kernel).__name__]
+    for path, parameter in sorted(gpflow.utilities.parameter_dict(kernel).items()):
+        key.append((path, np.asarray(parameter.numpy()).tobytes()))
+    return tuple(key)
+
+
+def is_fixed(module):
+    return len(module.trainable_parameters) == 0
+
+
+class KernelCache(object):
+    '''
+    LRU cache of kernel matrices and Cholesky factors shared by all genes, keyed on the inputs
+    fingerprint, the kernel type and its hyper-parameter values. The least recently used entries are
+    evicted once the stored matrices take more than max_bytes. Entries are read and added under a lock, so
+    genes fitted from several threads can share the cache.
+    '''
+
+    def __init__(self, max_bytes=256 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()  # reentrant, the Cholesky factor reads K(X,X) from the cache
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def get(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            self.misses += 1
+            value = compute()
+            self.entries[key] = value
+            self.nbytes += value.nbytes
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+            return value
+
+    def K(self, kernel, X, X2=None):
+        X = np.asarray(X)
+        key = ('K', fingerprint(X), None if X2 is None else fingerprint(np.asarray(X2)), kernel_key(kernel))
+        return self.get(key, lambda: kernel(X, X2).numpy())
+
+    def cholesky(self, kernel, X, noise):
+        '''
+        :return: lower Cholesky factor of K(X,X) + noise * I
+        '''
+        X = np.asarray(X)
+        key = ('L', fingerprint(X), kernel_key(kernel), float(noise))
+        return self.get(key, lambda: np.linalg.cholesky(self.K(kernel, X) + noise * np.eye(X.shape[0])))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+class CachedGPR(gpflow.models.GPR):
+    '''
+    GPR that reads K(X,X) and its Cholesky factor from a KernelCache: during fitting when the kernel
+    hyper-parameters are fixed, and in predictions where no gradient is needed.
+    '''
+
+    def __init__(self, data, kernel, kernel_cache, **kwargs):
+        super().__init__(data, kernel, **kwargs)
+        self.kernel_cache = kernel_cache
+        X = np.asarray(data[0])
+        # the kernel cannot change during optimization, so its matrix is a constant of the graph
+        self.cached_K = tf.constant(kernel_cache.K(kernel, X)) if is_fixed(kernel) else None
+
+    def log_marginal_likelihood(self):
+        if self.cached_K is None:
+            return super().log_marginal_likelihood()
+        X, Y = self.data
+        if is_fixed(self.likelihood) and tf.executing_eagerly():
+            L = tf.constant(self.kernel_cache.cholesky(self.kernel, X, self.likelihood.variance.numpy()))
+        else:
+            L = tf.linalg.cholesky(tf.linalg.set_diag(self.cached_K, tf.linalg.diag_part(self.cached_K)
+                                                      + self.likelihood.variance))
+        return tf.reduce_sum(multivariate_normal(Y, self.mean_function(X), L))
+
+    def predict_f(self, Xnew, full_cov=False, full_output_cov=False):
+        if not tf.executing_eagerly():
+            return super().predict_f(Xnew, full_cov=full_cov, full_output_cov=full_output_cov)
+        X, Y = self.data
+        L = tf.constant(self.kernel_cache.cholesky(self.kernel, X, self.likelihood.variance.numpy()))
+        err = Y - self.mean_function(X)
+        A = tf.linalg.triangular_solve(L, self.kernel(X, Xnew), lower=True)
+        v = tf.linalg.triangular_solve(L, err, lower=True)
+        mean = tf.linalg.matmul(A, v, transpose_a=True) + self.mean_function(Xnew)
+        if full_cov:
+            var = self.kernel(Xnew) - tf.linalg.matmul(A, A, transpose_a=True)
+            var = tf.tile(var[None, ...], [self.num_latent_gps, 1, 1])
+        else:
+            var = self.kernel(Xnew, full_cov=False) - tf.reduce_sum(tf.square(A), 0)
+            var = tf.tile(var[:, None], [1, self.num_latent_gps])
+        return mean, var
+
+
+class CachedSGPR(gpflow.models.SGPR):
+    '''
+    SGPR that reads Kuu, Kuf and diag(Kff) from a KernelCache when the kernel and the inducing
+    points are fixed during fitting.
+    '''
+
+    def __init__(self, data, kernel, inducing_variable, kernel_cache, **kwargs):
+        super().__init__(data, kernel, inducing_variable=inducing_variable, **kwargs)
+        self.kernel_cache = kernel_cache
+        self.cached_matrices = None
+        if is_fixed(kernel) and is_fixed(self.inducing_variable):
+            self.cache_matrices()
+
+    def cache_matrices(self):
+        X = np.asarray(self.data[0])
+        Z = self.inducing_variable.Z.numpy()
+        L = self.kernel_cache.cholesky(self.kernel, Z, default_jitter())
+        kuf = self.kernel_cache.K(self.kernel, Z, X)
+        Kdiag = self.kernel(X, full_cov=False)
+        self.cached_matrices = [tf.constant(L), tf.constant(kuf), Kdiag]
+
+    def elbo(self):
+        if self.cached_matrices is None:
+            return super().elbo()
+        X_data, Y_data = self.data
+        L, kuf, Kdiag = self.cached_matrices
+        num_inducing = kuf.shape[0]
+        num_data = tf.cast(tf.shape(Y_data)[0], default_float())
+        output_dim = tf.cast(tf.shape(Y_data)[1], default_float())
+        err = Y_data - self.mean_function(X_data)
+        sigma = tf.sqrt(self.likelihood.variance)
+
+        A = tf.linalg.triangular_solve(L, kuf, lower=True) / sigma
+        AAT = tf.linalg.matmul(A, A, transpose_b=True)
+        LB = tf.linalg.cholesky(AAT + tf.eye(num_inducing, dtype=default_float()))
+        c = tf.linalg.triangular_solve(LB, tf.linalg.matmul(A, err), lower=True) / sigma
+
+        bound = -0.5 * num_data * output_dim * np.log(2 * np.pi)
+        bound += tf.negative(output_dim) * tf.reduce_sum(tf.math.log(tf.linalg.diag_part(LB)))
+        bound -= 0.5 * num_data * output_dim * tf.math.log(self.likelihood.variance)
+        bound += -0.5 * tf.reduce_sum(tf.square(err)) / self.likelihood.variance
+        bound += 0.5 * tf.reduce_sum(tf.square(c))
+        bound += -0.5 * output_dim * tf.reduce_sum(Kdiag) / self.likelihood.variance
+        bound += 0.5 * output_dim * tf.reduce_sum(tf.linalg.diag_part(AAT))
+        return bound
+
+
+class CachedVGP(gpflow.models.VGP):
+    '''
+    VGP that reads the Cholesky factor of K(X,X) from a KernelCache when the kernel hyper-parameters
+    are fixed, as in the fixed branching kernel, so the factorization is done once for all genes.
+    '''
+
+    def __init__(self, data, kernel, likelihood, kernel_cache, **kwargs):
+        super().__init__(data, kernel, likelihood, **kwargs)
+        self.kernel_cache = kernel_cache
+        X = np.asarray(data[0])
+        self.cached_L = tf.constant(kernel_cache.cholesky(kernel, X, default_jitter())) if is_fixed(kernel) else None
+
+    def elbo(self):
+        if self.cached_L is None:
+            return super().elbo()
+        X_data, Y_data = self.data
+        KL = gpflow.kullback_leiblers.gauss_kl(self.q_mu, self.q_sqrt)
+        L = self.cached_L
+        fmean = tf.linalg.matmul(L, self.q_mu) + self.mean_function(X_data)
+        q_sqrt_dnn = tf.linalg.band_part(self.q_sqrt, -1, 0)
+        L_tiled = tf.tile(tf.expand_dims(L, 0), tf.stack([self.num_latent_gps, 1, 1]))
+        fvar = tf.transpose(tf.reduce_sum(tf.square(tf.linalg.matmul(L_tiled, q_sqrt_dnn)), 2))
+        var_exp = self.likelihood.variational_expectations(fmean, fvar, Y_data)
+        return tf.reduce_sum(var_exp) - KL
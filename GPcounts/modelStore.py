@@ -0,0 +1,95 @@
+import glob
+import os
+import uuid
+import numpy as np
+import gpflow
+
+
+class ModelStore(object):
+    '''
+    Parameters of all the models fitted in a test, keyed by gene and model index and written to a single
+    .npz file. Models with the same parameters and shapes are stacked as rows of one array, so the file
+    holds a few arrays instead of one checkpoint per model. Journaled runs flush the models of every finished
+    gene to a part file next to it, parts are read with the file and merged into it by save.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.models = {}  # key -> {parameter path: value}
+        self.flushed = set()  # keys of the models already written to a part file
+
+    def add(self, key, model):
+        self.models[key] = {path: parameter.numpy() for path, parameter in gpflow.utilities.parameter_dict(model).items()}
+
+    def get(self, key):
+        return self.models.get(key)
+
+    def update(self, models):
+        self.models.update(models)
+
+    def load(self):
+        self.models = self.read()
+        return self
+
+    def parts(self):
+        return sorted(glob.glob(glob.escape(self.filename) + '.part_*.npz'))
+
+    def read(self, parts=None):
+        models = {}
+        for filename in [self.filename] + (self.parts() if parts is None else parts):
+            if os.path.exists(filename):
+                models.update(self.read_file(filename))
+        return models
+
+    def read_file(self, filename):
+        models = {}
+        with np.load(filename) as arrays:
+            group = 0
+            while 'keys_%d' % group in arrays:
+                paths = arrays['paths_%d' % group]
+                shapes = [tuple(int(n) for n in shape.split(',') if n) for shape in arrays['shapes_%d' % group]]
+                sizes = [int(np.prod(shape)) for shape in shapes]
+                offsets = np.cumsum([0] + sizes)
+                for key, values in zip(arrays['keys_%d' % group], arrays['values_%d' % group]):
+                    models[str(key)] = {str(path): values[offsets[j]:offsets[j + 1]].reshape(shapes[j])
+                                        for j, path in enumerate(paths)}
+                group += 1
+        return models
+
+    def save(self):
+        # keep the models of genes fitted by previous runs of the same test
+        parts = self.parts()
+        models = self.read(parts)
+        models.update(self.models)
+        self.write(self.filename, models)
+        for filename in parts:
+            os.remove(filename)
+
+    def flush(self):
+        '''
+        Write the models added since the last flush to a new part file, so an interrupted run keeps them
+        '''
+        models = {key: params for key, params in self.models.items() if key not in self.flushed}
+        if models:
+            self.write('%s.part_%s.npz' % (self.filename, uuid.uuid4().hex), models)
+            self.flushed.update(models)
+
+    def write(self, filename, models):
+        groups = {}
+        for key, params in models.items():
+            signature = tuple((path, np.shape(value)) for path, value in sorted(params.items()))
+            groups.setdefault(signature, []).append(key)
+
+        arrays = {}
+        for group, (signature, keys) in enumerate(groups.items()):
+            arrays['keys_%d' % group] = np.array(keys)
+            arrays['paths_%d' % group] = np.array([path for path, _ in signature])
+            arrays['shapes_%d' % group] = np.array([','.join(str(n) for n in shape) for _, shape in signature])
+            arrays['values_%d' % group] = np.vstack([np.concatenate([np.ravel(models[key][path]) for path, _ in signature])
+                                                     for key in keys])
+
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_filename, filename)
@@ -1,36 +1,43 @@
 
-import scipy as sp
+import hashlib
+import numpy as np
+import scipy.stats as ss
 from scipy import interpolate
 
+def fingerprint(X):
+    '''
+    Hash of the values, shape and dtype of an array, used to recognise identical inputs
+    '''
+    X = np.ascontiguousarray(X)
+    return hashlib.sha1(X.tobytes()).hexdigest() + str(X.shape) + str(X.dtype)
+
 def qvalue(pv, pi0=None):
     '''
     Estimates q-values from p-values
     This function is modified based on https://github.com/nfusi/qvalue
     Args
     ====
+    pv: array or pandas Series of p-values of any shape
     pi0: if None, it's estimated as suggested in Storey and Tibshirani, 2003.
     '''
+    pv = np.asarray(pv, dtype=float)
     assert(pv.min() >= 0 and pv.max() <= 1), "p-values should be between 0 and 1"
 
     original_shape = pv.shape
-    pv = pv.ravel()  # flattens the array in place, more efficient than flatten()
-
+    pv = pv.ravel()
     m = float(len(pv))
 
+    p_ordered = np.argsort(pv)
+    pv = pv[p_ordered]
+
     # if the number of hypotheses is small, just set pi0 to 1
     if len(pv) < 100 and pi0 is None:
         pi0 = 1.0
-    elif pi0 is not None:
-        pi0 = pi0
-    else:
-        # evaluate pi0 for different lambdas
-        pi0 = []
-        lam = sp.arange(0, 0.90, 0.01)
-        counts = sp.array([(pv > i).sum() for i in sp.arange(0, 0.9, 0.01)])
-        for l in range(len(lam)):
-            pi0.append(counts[l]/(m*(1-lam[l])))
-
-        pi0 = sp.array(pi0)
+    elif pi0 is None:
+        # evaluate pi0 for different lambdas, counting the p-values above every lambda in the sorted p-values
+        lam = np.arange(0, 0.90, 0.01)
+        counts = len(pv) - np.searchsorted(pv, lam, side='right')
+        pi0 = counts/(m*(1-lam))
 
         # fit natural cubic spline
         tck = interpolate.splrep(lam, pi0, k=3)
@@ -41,20 +48,44 @@ def qvalue(pv, pi0=None):
 
     assert(pi0 >= 0 and pi0 <= 1), "pi0 is not between 0 and 1: %f" % pi0
 
-    p_ordered = sp.argsort(pv)
-    pv = pv[p_ordered]
-    qv = pi0 * m/len(pv) * pv
-    qv[-1] = min(qv[-1], 1.0)
+    # monotone q-values: cumulative minimum of pi0*m*p(i)/i from the largest p-value down
+    qv = pi0*m*pv/np.arange(1.0, len(pv)+1)
+    qv[-1] = min(pi0 * m/len(pv) * pv[-1], 1.0)
+    qv = np.minimum.accumulate(qv[::-1])[::-1]
+
+    # reorder and reshape qvalues
+    qv[p_ordered] = qv.copy()
+    return qv.reshape(original_shape)
 
-    for i in range(len(pv)-2, -1, -1):
-        qv[i] = min(pi0*m*pv[i]/(i+1.0), qv[i+1])
+def p_values(log_likelihood_ratio):
+    '''
+    p-values of the likelihood ratio test with one degree of freedom
+    '''
+    return 1 - ss.chi2.cdf(log_likelihood_ratio, df=1)
 
-    # reorder qvalues
-    qv_temp = qv.copy()
-    qv = sp.zeros_like(qv)
-    qv[p_ordered] = qv_temp
+def calculate_FDR(genes_results):
+    '''
+    Adds the 'p value' and 'q value' columns to one or many results tables with a 'log_likelihood_ratio' column,
+    the q-values of every table are estimated separately and genes with a missing likelihood ratio get missing values
+    :param genes_results: DataFrame, or list or dict of DataFrames
+    :return: the same tables with the new columns
+    '''
+    if isinstance(genes_results, dict):
+        tables = list(genes_results.values())
+    elif isinstance(genes_results, (list, tuple)):
+        tables = list(genes_results)
+    else:
+        tables = [genes_results]
 
-    # reshape qvalues
-    qv = qv.reshape(original_shape)
+    # p-values of all tables at once
+    sizes = [len(table) for table in tables]
+    pv = p_values(np.concatenate([np.asarray(table['log_likelihood_ratio'], dtype=float) for table in tables]))
+    for table, table_pv in zip(tables, np.split(pv, np.cumsum(sizes)[:-1])):
+        table['p value'] = table_pv
+        qv = np.full(len(table_pv), np.nan)
+        tested = ~np.isnan(table_pv)
+        if tested.any():
+            qv[tested] = qvalue(table_pv[tested])
+        table['q value'] = qv
 
-    return qv
\ No newline at end of file
+    return genes_results
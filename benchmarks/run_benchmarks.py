@@ -0,0 +1,141 @@
+'''
+Time the GPcounts tests on simulated data and write the results as JSON to compare versions.
+
+Every workload runs in a fresh process so its peak resident memory and TensorFlow state do not depend on the other
+workloads. The batched mode fits full GPs in blocks of --batch_size genes, to compare with the full mode that fits them
+one by one. Example:
+
+    python benchmarks/run_benchmarks.py --genes 64 --cells 100 --modes full batched --output results.json
+'''
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulate import simulate
+
+Workloads = ['One_sample_test', 'Two_samples_test', 'Infer_trajectory', 'Infer_branching_location',
+             'load_predict_models']
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak / scale
+
+
+def run_workload(workload, mode, config):
+    from GPcounts.GPcounts_Module import Fit_GPcounts
+
+    X, Y, labels, _ = simulate(genes=config['genes'], cells=config['cells'], replicates=config['replicates'],
+                               dispersion=config['dispersion'], km=config['km'],
+                               branching=workload == 'Infer_branching_location', seed=config['seed'])
+    if workload == 'Infer_branching_location':
+        Y = Y.iloc[0:1]  # the branching time is inferred for one gene, a branching one
+    os.chdir(tempfile.mkdtemp())  # saved models of every workload go to their own folder
+    gp = Fit_GPcounts(X, Y, sparse=mode == 'sparse', save_models=config['save_models'])
+    gp.progress_bar = False
+    lik_name = config['likelihood']
+    genes = Y.shape[0]
+    batch_size = config['batch_size'] if mode == 'batched' else None
+
+    start = time.perf_counter()
+    if workload == 'One_sample_test':
+        gp.One_sample_test(lik_name, n_jobs=config['n_jobs'], batch_size=batch_size)
+    elif workload == 'Two_samples_test':
+        gp.Two_samples_test(lik_name, n_jobs=config['n_jobs'], batch_size=batch_size)
+    elif workload == 'Infer_trajectory':
+        gp.Infer_trajectory(lik_name, n_jobs=config['n_jobs'], batch_size=batch_size)
+    elif workload == 'Infer_branching_location':
+        gp.Infer_branching_location(labels, bins_num=config['bins_num'], lik_name=lik_name, n_jobs=config['n_jobs'])
+    else:
+        # predictions from the models saved by the one sample test
+        gp.One_sample_test(lik_name, n_jobs=config['n_jobs'], batch_size=batch_size)
+        restarts = gp.restarts
+        start = time.perf_counter()
+        gp.load_predict_models(list(Y.index), 'One_sample_test', lik_name)
+        gp.restarts -= restarts
+    seconds = time.perf_counter() - start
+
+    return {'workload': workload, 'mode': mode, 'genes': genes, 'cells': Y.shape[1], 'likelihood': lik_name,
+            'seconds': seconds, 'genes_per_second': genes / seconds, 'peak_rss_mb': peak_rss_mb(),
+            'restarts': gp.restarts, 'batched_refits': gp.batched_refits}
+
+
+def version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    import numpy as np
+    import tensorflow as tf
+    import gpflow
+    return {'version': version(), 'python': platform.python_version(), 'platform': platform.platform(),
+            'numpy': np.__version__, 'tensorflow': tf.__version__, 'gpflow': gpflow.__version__,
+            'cpus': os.cpu_count()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workloads', nargs='+', default=Workloads, choices=Workloads)
+    parser.add_argument('--modes', nargs='+', default=['full', 'sparse'], choices=['full', 'sparse', 'batched'])
+    parser.add_argument('--genes', type=int, default=20)
+    parser.add_argument('--cells', type=int, default=100, help='cells, or time points of bulk data with --replicates')
+    parser.add_argument('--replicates', type=int, default=None, help='replicates per time point of bulk data')
+    parser.add_argument('--dispersion', default='low', choices=['low', 'high'])
+    parser.add_argument('--km', type=float, default=None, help='zero inflation Michaelis-Menten constant')
+    parser.add_argument('--likelihood', default='Negative_binomial',
+                        choices=['Negative_binomial', 'Zero_inflated_negative_binomial', 'Poisson', 'Gaussian'])
+    parser.add_argument('--bins_num', type=int, default=10, help='branching times of Infer_branching_location')
+    parser.add_argument('--n_jobs', type=int, default=1)
+    parser.add_argument('--batch_size', type=int, default=16, help='genes fitted together in the batched mode')
+    parser.add_argument('--save_models', default='checkpoint', choices=['checkpoint', 'store'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='JSON file, printed when not given')
+    args = parser.parse_args(argv)
+
+    config = {name: value for name, value in vars(args).items() if name not in ['workloads', 'modes', 'output']}
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for workload in args.workloads:
+        for mode in args.modes:
+            if workload == 'Infer_branching_location' and mode == 'sparse':
+                results.append({'workload': workload, 'mode': mode, 'skipped': 'branching fits full GPs'})
+                continue
+            if workload == 'Infer_branching_location' and mode == 'batched':
+                results.append({'workload': workload, 'mode': mode, 'skipped': 'branching fits genes one by one'})
+                continue
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_workload, workload, mode, config).result()
+            print('%s %s: %.2f s, %.3f genes/s, %.0f MB, %d restarts, %d batched refits' % (workload, mode,
+                  result['seconds'], result['genes_per_second'], result['peak_rss_mb'], result['restarts'],
+                  result['batched_refits']), file=sys.stderr)
+            results.append(result)
+
+    report = json.dumps({'environment': environment(), 'config': config, 'results': results}, indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(report)
+
+
+if __name__ == '__main__':
+    main()
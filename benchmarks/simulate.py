@@ -0,0 +1,93 @@
+'''
+Synthetic count data for the benchmarks, generated as in paper_notebooks/Bulk_simulator.py but for all genes at once.
+
+Half of the genes are dynamic, with sine f(x) = a*sin(xb+d)+c or cubic spline generative functions, and every dynamic
+gene has a matching constant gene f(x) = median(f). Counts are sampled from the negative binomial distribution with
+mean exp(f) and dispersion drawn from a uniform distribution, and zeros are added with probability 1 - mean/(km+mean) as in
+the zero inflated negative binomial likelihood when km is given. Branching data split the cells in two lineages labelled
+1 and 2 that share f before the branching time of the gene and diverge linearly after it.
+'''
+
+import numpy as np
+import pandas as pd
+from scipy.interpolate import CubicSpline
+
+Dispersion_ranges = {'low': (.01, .1), 'high': (1., 3.)}
+
+
+def time_points(cells, replicates=None, rng=None):
+    '''
+    :param cells: number of cells, or of time points of bulk data when replicates is given
+    :return: sorted times in [0,1], a uniform pseudotime per cell or a grid of time points with replicates
+    '''
+    if replicates is not None:
+        return np.repeat(np.linspace(0., 1., cells), replicates)
+    return np.sort(rng.uniform(0., 1., cells))
+
+
+def generative_functions(x, genes, rng, amplitude=.7, mean=.5):
+    '''
+    :return: genes X cells values of the dynamic functions, half sine and half cubic splines
+    '''
+    sines = genes - genes // 2
+    b = rng.uniform(np.pi / 2, np.pi * 2, (sines, 1))
+    d = rng.uniform(0, np.pi * 2, (sines, 1))
+    f_sine = mean + amplitude * np.sin(b * x[None, :] + d)
+
+    knots = rng.uniform(mean - amplitude, mean + 2 * amplitude, (3, genes // 2))
+    f_spline = CubicSpline(np.linspace(0., 1., 3), knots, axis=0)(x).T
+
+    f = np.empty((genes, len(x)))
+    f[0::2] = f_sine
+    f[1::2] = f_spline
+    return f
+
+
+def sample_counts(f, alpha, rng, km=None):
+    mean = np.exp(f)
+    r = 1. / alpha[:, None]
+    counts = rng.negative_binomial(r, r / (mean + r)).astype(float)
+    if km is not None:
+        psi = 1. - mean / (km + mean)  # probability of zeros
+        counts[rng.random(counts.shape) < psi] = 0.
+    return counts
+
+
+def simulate(genes=100, cells=100, replicates=None, dispersion='low', km=None, amplitude=.7, mean=.5,
+             branching=False, seed=0):
+    '''
+    :param genes: number of genes, the first half dynamic and the second half constant
+    :param cells: number of cells, or of time points when replicates is given
+    :param replicates: replicates per time point of bulk data, None for single cell data with uniform pseudotime
+    :param dispersion: 'low', 'high' or a (low, high) range of the uniform distribution of the dispersion
+    :param km: Michaelis-Menten constant of the zero inflation, None for negative binomial counts
+    :param branching: split the cells in two lineages, the second half of the genes is not branching
+    :param seed: seed of the numpy random generator, the same seed gives the same data
+    :return: X (cells X 1 times), Y (genes X cells counts), cell labels or None and a DataFrame of genes truth
+    '''
+    rng = np.random.default_rng(seed)
+    dispersion = Dispersion_ranges.get(dispersion, dispersion)
+    x = time_points(cells, replicates, rng)
+    dynamic = genes - genes // 2
+
+    f = generative_functions(x, dynamic, rng, amplitude, mean)
+    f = np.vstack([f, np.median(f[0:genes // 2], axis=1)[:, None] * np.ones(len(x))])
+    labels = None
+    branching_times = np.full(genes, np.nan)
+    if branching:
+        labels = rng.integers(1, 3, len(x)).astype(float)
+        branching_times[0:dynamic] = rng.uniform(.2, .8, dynamic)
+        slopes = rng.choice([-1., 1.], dynamic) * rng.uniform(1., 3., dynamic)
+        after = np.maximum(x[None, :] - branching_times[0:dynamic, None], 0.)
+        f[0:dynamic] += (labels[None, :] == 2) * slopes[:, None] * after
+
+    alpha = rng.uniform(dispersion[0], dispersion[1], genes)
+    counts = sample_counts(f, alpha, rng, km)
+
+    genes_name = ['gene_%d' % (g + 1) for g in range(genes)]
+    cells_name = ['cell_%d' % (c + 1) for c in range(len(x))]
+    X = pd.DataFrame(data=x, index=cells_name, columns=['times'])
+    Y = pd.DataFrame(data=counts, index=genes_name, columns=cells_name)
+    truth = pd.DataFrame({'dynamic': np.arange(genes) < dynamic, 'alpha': alpha, 'branching_time': branching_times},
+                         index=genes_name)
+    return X, Y, labels, truth
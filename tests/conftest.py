@@ -0,0 +1,55 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def simulate_counts(genes=4, cells=24, seed=1):
+    '''
+    :return: X (cells X 1 times) and Y (genes X cells negative binomial counts), the first half of the genes dynamic
+    and the second half constant
+    '''
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0., 1., cells)
+    dynamic = genes - genes // 2
+    f = np.vstack([1.5 + np.sin(rng.uniform(np.pi, 2 * np.pi) * x + rng.uniform(0, 2 * np.pi)) for _ in range(dynamic)]
+                  + [np.full(cells, rng.uniform(.5, 2.)) for _ in range(genes // 2)])
+    r = 10.
+    counts = rng.negative_binomial(r, r / (np.exp(f) + r)).astype(float)
+    cells_name = ['cell_%d' % (c + 1) for c in range(cells)]
+    X = pd.DataFrame(data=x, index=cells_name, columns=['times'])
+    Y = pd.DataFrame(data=counts, index=['gene_%d' % (g + 1) for g in range(genes)], columns=cells_name)
+    return X, Y
+
+
+@pytest.fixture(scope='session')
+def data():
+    return simulate_counts()
+
+
+@pytest.fixture(scope='session')
+def one_sample_baseline(data, tmp_path_factory):
+    # serial negative binomial one sample test that the other modes are compared with
+    X, Y = data
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('baseline'))
+    try:
+        return fit_gpcounts(X, Y).One_sample_test('Negative_binomial')
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(autouse=True)
+def working_directory(tmp_path, monkeypatch):
+    # models and journals are written in a fresh folder for every test
+    monkeypatch.chdir(tmp_path)
+
+
+def fit_gpcounts(X, Y, **kwargs):
+    from GPcounts.GPcounts_Module import Fit_GPcounts
+    gp = Fit_GPcounts(X, Y, **kwargs)
+    gp.progress_bar = False
+    return gp
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+from GPcounts import batchedGP
+from conftest import fit_gpcounts
+
+
+@pytest.mark.parametrize('likelihood', ['Negative_binomial', 'Poisson'])
+def test_batched_test_matches_serial_test(data, likelihood):
+    X, Y = data
+    serial = fit_gpcounts(X, Y).One_sample_test(likelihood)
+    gp = fit_gpcounts(X, Y)
+    batched = gp.One_sample_test(likelihood, batch_size=4)
+    assert list(batched.index) == list(serial.index)
+    np.testing.assert_allclose(batched.values, serial.values, atol=1e-3)
+
+
+def test_constant_model_starts_as_in_serial_test(data, monkeypatch):
+    X, Y = data
+    alphas = []
+    fit_batched_model = batchedGP.BatchedGP.fit
+
+    def fit(self, Y, values, **kwargs):
+        if self.constant_kernel:
+            alphas.append(values['alpha'])
+        return fit_batched_model(self, Y, values, **kwargs)
+
+    monkeypatch.setattr(batchedGP.BatchedGP, 'fit', fit)
+    gp = fit_gpcounts(X, Y.iloc[0:2])
+    gp.One_sample_test('Zero_inflated_negative_binomial', batch_size=2)
+    # the dispersion of the dynamic model seeds only the negative binomial constant model
+    np.testing.assert_array_equal(alphas[0], np.ones(2))
+
+
+def test_genes_that_do_not_converge_are_refitted_one_by_one(data, monkeypatch):
+    X, Y = data
+    fit_batched_model = batchedGP.BatchedGP.fit
+
+    def fit(self, Y, values, **kwargs):
+        log_likelihood, params, converged = fit_batched_model(self, Y, values, **kwargs)
+        return log_likelihood, params, np.zeros_like(converged)
+
+    serial = fit_gpcounts(X, Y.iloc[0:2]).One_sample_test('Gaussian')
+    monkeypatch.setattr(batchedGP.BatchedGP, 'fit', fit)
+    gp = fit_gpcounts(X, Y.iloc[0:2])
+    batched = gp.One_sample_test('Gaussian', batch_size=2)
+    assert gp.batched_refits == 2
+    pd.testing.assert_frame_equal(batched, serial)
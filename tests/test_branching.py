@@ -0,0 +1,53 @@
+import os
+import numpy as np
+import pytest
+from GPcounts import geneFit
+from conftest import simulate_counts, fit_gpcounts
+
+
+def branching_data(cells=30):
+    X, Y = simulate_counts(genes=1, cells=cells, seed=3)
+    labels = np.tile([1., 2.], cells // 2)
+    # the second lineage rises after t = 0.5
+    Y.iloc[0] += np.where((labels == 2) & (X['times'].values > .5), 8., 0.)
+    return X, Y, labels
+
+
+def infer_branching(n_jobs, search='grid', bins_num=6):
+    X, Y, labels = branching_data()
+    gp = fit_gpcounts(X, Y)
+    return gp, gp.Infer_branching_location(labels, bins_num=bins_num, lik_name='Gaussian', n_jobs=n_jobs,
+                                           search=search)
+
+
+def test_parallel_scan_matches_serial_scan():
+    # default arguments save checkpoints, the bins fitted by the workers must not write them
+    _, serial = infer_branching(n_jobs=1)
+    _, parallel = infer_branching(n_jobs=2)
+    np.testing.assert_allclose(parallel['loglik'], serial['loglik'], rtol=1e-8)
+    np.testing.assert_allclose(parallel['branching_probability'], serial['branching_probability'], rtol=1e-6)
+    assert parallel['branching_location'] == serial['branching_location']
+
+
+def test_scan_saves_the_map_model():
+    gp, results = infer_branching(n_jobs=1)
+    file_name = gp.get_file_prefix() + gp.get_model_key(0, 1)
+    assert os.path.exists(file_name + '.index')
+    restored = geneFit.restore_model(gp.X, gp.gene_counts(0).reshape([-1, 1]), 'Gaussian',
+                                     {'name': 'Branching', 'xp': 0.}, file_name=file_name)
+    np.testing.assert_allclose(restored.kernel.xp.numpy(), results['branching_location'])
+
+
+def test_adaptive_search_keeps_to_the_fit_budget():
+    _, grid = infer_branching(n_jobs=1, bins_num=12)
+    _, adaptive = infer_branching(n_jobs=1, search='adaptive', bins_num=12)
+    assert len(adaptive['test_times']) <= 12
+    spacing = grid['test_times'][1] - grid['test_times'][0]
+    assert abs(adaptive['branching_location'] - grid['branching_location']) <= spacing
+
+
+def test_scan_needs_two_bins():
+    X, Y, labels = branching_data()
+    gp = fit_gpcounts(X, Y)
+    with pytest.raises(ValueError):
+        gp.Infer_branching_location(labels, bins_num=1, lik_name='Gaussian')
@@ -0,0 +1,51 @@
+import gpflow
+import numpy as np
+from GPcounts.branchingKernel import BranchKernel
+
+
+def dense_K(kern, xp, X, Y):
+    '''
+    K of the baseline BranchKernel computed on all inputs, k(t1, t2) for the same functions and
+    k(t1, B) k(B, B)^-1 k(B, t2) between functions, xp[i, j] the branch points of the functions labelled i+1 and j+1
+    '''
+    Ktts = kern.K(X[:, 0:1], Y[:, 0:1]).numpy()
+    K = np.zeros_like(Ktts)
+    for a in np.unique(X[:, 1]):
+        for b in np.unique(Y[:, 1]):
+            pair = np.outer(X[:, 1] == a, Y[:, 1] == b)
+            if a == b:
+                K[pair] = Ktts[pair]
+                continue
+            Bs = np.reshape(xp[int(a) - 1, int(b) - 1], [-1, 1])
+            Kbbs_inv = np.linalg.inv(kern.K(Bs).numpy() + np.eye(len(Bs)) * gpflow.config.default_jitter())
+            K_cross = kern.K(X[:, 0:1], Bs).numpy() @ Kbbs_inv @ kern.K(Bs, Y[:, 0:1]).numpy()
+            K[pair] = K_cross[pair]
+    return K
+
+
+def inputs(labels, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.c_[rng.uniform(0., 1., len(labels)), labels]
+
+
+def test_one_branching_point_matches_baseline():
+    kern = gpflow.kernels.RBF(lengthscales=.3)
+    kernel = BranchKernel(kern, .4)
+    X = inputs([1, 2, 2, 1, 2, 1, 1, 2, 1])
+    Y = inputs([2, 1, 1, 2], seed=1)
+    xp = np.full((2, 2), .4)
+    np.testing.assert_allclose(kernel.K(X).numpy(), dense_K(kern, xp, X, X) + 1e-6 * np.eye(len(X)), atol=1e-12)
+    np.testing.assert_allclose(kernel.K(X, Y).numpy(), dense_K(kern, xp, X, Y), atol=1e-12)
+    np.testing.assert_allclose(kernel.K_diag(X).numpy(), np.diag(kernel.K(X).numpy()))
+
+
+def test_several_branching_points_match_baseline():
+    kern = gpflow.kernels.RBF(lengthscales=.3)
+    xp = np.array([[[0., 0.], [.2, .5], [.3, .6]],
+                   [[.2, .5], [0., 0.], [.4, .7]],
+                   [[.3, .6], [.4, .7], [0., 0.]]])
+    kernel = BranchKernel(kern, xp)
+    X = inputs([3, 1, 2, 2, 3, 1, 1, 2, 3, 1])
+    Y = inputs([2, 3, 1], seed=1)
+    np.testing.assert_allclose(kernel.K(X).numpy(), dense_K(kern, xp, X, X) + 1e-6 * np.eye(len(X)), atol=1e-12)
+    np.testing.assert_allclose(kernel.K(X, Y).numpy(), dense_K(kern, xp, X, Y), atol=1e-12)
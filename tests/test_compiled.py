@@ -0,0 +1,27 @@
+import numpy as np
+import gpflow
+from conftest import fit_gpcounts
+
+
+def test_compiled_fit_matches_serial_test(data, one_sample_baseline):
+    X, Y = data
+    compiled = fit_gpcounts(X, Y, save_models=None, compiled_fit=True).One_sample_test('Negative_binomial')
+    np.testing.assert_allclose(compiled.values, one_sample_baseline.values, atol=1e-2)
+
+
+def test_compiled_fit_gives_every_gene_its_own_model(data, monkeypatch):
+    X, Y = data
+    from GPcounts.GPcounts_Module import Fit_GPcounts
+    fitted = []
+
+    def save_model(self, *args):
+        # parameters of the model when its gene is fitted, compared once the later genes are fitted
+        values = {path: np.array(value) for path, value in gpflow.utilities.read_values(self.model).items()}
+        fitted.append((self.model, values))
+
+    monkeypatch.setattr(Fit_GPcounts, 'save_model', save_model)
+    fit_gpcounts(X, Y, save_models=None, compiled_fit=True).One_sample_test('Negative_binomial')
+    assert len(set(id(model) for model, _ in fitted)) == len(fitted)
+    for model, values in fitted:
+        for path, value in gpflow.utilities.read_values(model).items():
+            np.testing.assert_array_equal(value, values[path])
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import pytest
+from GPcounts.countsReader import CountsReader
+from conftest import fit_gpcounts
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.npy', '.npz'])
+def test_chunks_hold_the_counts(data, extension):
+    _, Y = data
+    path = 'counts' + extension
+    if extension == '.csv':
+        Y.to_csv(path)
+    elif extension == '.npy':
+        np.save(path, Y.values)
+    else:
+        scipy.sparse.save_npz(path, scipy.sparse.csr_matrix(Y.values))
+    reader = CountsReader(path, chunk_size=3)
+    assert reader.shape == Y.shape
+    chunks = [chunk.toarray() if scipy.sparse.issparse(chunk) else chunk for _, chunk in reader.chunks()]
+    assert [len(chunk) for chunk in chunks] == [3, 1]
+    np.testing.assert_array_equal(np.vstack(chunks), Y.values)
+
+
+def test_counts_files_match_data_frame(data, one_sample_baseline):
+    X, Y = data
+    Y.to_csv('counts.csv')
+    np.save('counts.npy', Y.values)
+    from_csv = fit_gpcounts(X, 'counts.csv').One_sample_test('Negative_binomial')
+    pd.testing.assert_frame_equal(from_csv, one_sample_baseline)
+    from_npy = fit_gpcounts(X, 'counts.npy').One_sample_test('Negative_binomial')
+    np.testing.assert_array_equal(from_npy.values, one_sample_baseline.values)
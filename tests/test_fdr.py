@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.stats as ss
+from scipy import interpolate
+from GPcounts.utilities import qvalue, calculate_FDR
+
+
+def baseline_qvalue(pv):
+    # q-values of the baseline loop, with numpy in place of the removed scipy aliases
+    pv = pv.ravel()
+    m = float(len(pv))
+    if len(pv) < 100:
+        pi0 = 1.0
+    else:
+        lam = np.arange(0, 0.90, 0.01)
+        counts = np.array([(pv > i).sum() for i in np.arange(0, 0.9, 0.01)])
+        pi0 = np.array([counts[l] / (m * (1 - lam[l])) for l in range(len(lam))])
+        tck = interpolate.splrep(lam, pi0, k=3)
+        pi0 = min(interpolate.splev(lam[-1], tck), 1.0)
+    p_ordered = np.argsort(pv)
+    pv = pv[p_ordered]
+    qv = pi0 * m / len(pv) * pv
+    qv[-1] = min(qv[-1], 1.0)
+    for i in range(len(pv) - 2, -1, -1):
+        qv[i] = min(pi0 * m * pv[i] / (i + 1.0), qv[i + 1])
+    qv_temp = qv.copy()
+    qv = np.zeros_like(qv)
+    qv[p_ordered] = qv_temp
+    return qv
+
+
+@pytest.mark.parametrize('genes', [50, 1000])
+def test_qvalue_matches_baseline(genes):
+    rng = np.random.default_rng(0)
+    pv = np.concatenate([rng.uniform(0., 1., genes - genes // 5), rng.uniform(0., 1e-3, genes // 5)])
+    pv[:10] = pv[10]  # ties
+    np.testing.assert_allclose(qvalue(pv), baseline_qvalue(pv), rtol=1e-12)
+
+
+def test_calculate_FDR_matches_baseline():
+    rng = np.random.default_rng(1)
+    results = pd.DataFrame({'log_likelihood_ratio': rng.exponential(2., 200)}, index=['gene_%d' % i for i in range(200)])
+    expected = results.copy()
+    expected['p value'] = 1 - ss.chi2.cdf(expected['log_likelihood_ratio'], df=1)
+    expected['q value'] = baseline_qvalue(expected['p value'].values)
+    pd.testing.assert_frame_equal(calculate_FDR(results), expected)
@@ -0,0 +1,44 @@
+import concurrent.futures
+import numpy as np
+import tensorflow as tf
+from GPcounts import geneFit
+from GPcounts import kernelCache
+
+
+def fit(X, y, likelihood, seed=0, options=None):
+    x = X.values.reshape([-1, 1])
+    y = y.reshape([-1, 1])
+    init = geneFit.initial_hyper_parameters(x, y, likelihood)
+    return geneFit.fit_gene(x, y, likelihood, 'RBF', init, seed, options=options)
+
+
+def test_threaded_fits_match_serial_fits(data):
+    X, Y = data
+    options = {'kernel_cache': kernelCache.KernelCache(), 'safe_mode': True}
+    serial = [fit(X, Y.values[i], 'Negative_binomial', options=options).log_likelihood for i in range(len(Y))]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(Y)) as executor:
+        futures = [executor.submit(fit, X, Y.values[i], 'Negative_binomial', 0, options) for i in range(len(Y))]
+        threaded = [future.result().log_likelihood for future in futures]
+    np.testing.assert_allclose(threaded, serial, rtol=1e-8)
+
+
+def test_fit_keeps_global_tensorflow_state(data):
+    X, Y = data
+    tf.random.set_seed(5)
+    expected = tf.random.uniform([3]).numpy()
+    tf.random.set_seed(5)
+    fit(X, Y.values[0], 'Gaussian', seed=0)
+    np.testing.assert_array_equal(tf.random.uniform([3]).numpy(), expected)
+
+
+def test_posterior_samples_do_not_depend_on_global_seed(data):
+    X, Y = data
+    model = fit(X, Y.values[0], 'Negative_binomial').model
+    xtest = np.linspace(0., 1., 10)[:, None]
+    samples = []
+    for global_seed in [1, 2]:
+        tf.random.set_seed(global_seed)
+        samples.append(geneFit.samples_posterior_predictive_distribution(model, 'Negative_binomial', xtest, seed=3,
+                                                                          f_samples_number=10, y_samples_number=20))
+    np.testing.assert_array_equal(samples[0][0], samples[1][0])
+    np.testing.assert_array_equal(samples[0][1], samples[1][1])
@@ -0,0 +1,33 @@
+import gpflow
+import numpy as np
+import pytest
+from GPcounts.inducingPoints import select_inducing_points
+from conftest import fit_gpcounts
+
+
+@pytest.mark.parametrize('method', ['kmeans', 'minibatch_kmeans', 'quantile', 'greedy_variance'])
+def test_inducing_points_of_replicated_inputs_are_distinct(method):
+    # bulk time series, 6 time points of 4 replicates
+    X = np.repeat(np.linspace(0., 1., 6), 4)[:, None]
+    Z = select_inducing_points(X, 8, method)
+    assert 0 < len(Z) <= 8
+    assert np.all(np.diff(Z[:, 0]) > 1e-6)
+    assert 0. <= Z.min() and Z.max() <= 1.
+    Kuu = gpflow.kernels.RBF(lengthscales=.05).K(Z).numpy()
+    np.linalg.cholesky(Kuu + gpflow.config.default_jitter() * np.eye(len(Z)))
+
+
+def test_inducing_points_are_selected_once_per_inputs(data):
+    X, Y = data
+    gp = fit_gpcounts(X, Y, sparse=True)
+    assert gp.get_inducing_points(gp.X) is gp.Z
+    assert len(gp.inducing_points_cache) == 1
+
+
+def test_sparse_test_with_all_cells_as_inducing_points_matches_full_test(data):
+    X, Y = data
+    full = fit_gpcounts(X, Y.iloc[0:2], save_models=None).Infer_trajectory('Gaussian')
+    gp = fit_gpcounts(X, Y.iloc[0:2], sparse=True, save_models=None)
+    gp.Z, gp.M = gp.X, gp.N
+    sparse = gp.Infer_trajectory('Gaussian')
+    np.testing.assert_allclose(sparse.values, full.values, rtol=1e-3)
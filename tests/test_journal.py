@@ -0,0 +1,100 @@
+import glob
+import gpflow
+import pytest
+import pandas as pd
+from conftest import fit_gpcounts
+
+
+def count_fits(gp):
+    # genes fitted by the run, the serial loop journals every gene it fits
+    fitted = []
+    append_journal = gp.append_journal
+
+    def append(genes_results):
+        fitted.extend(gene for gene, _ in genes_results)
+        append_journal(genes_results)
+
+    gp.append_journal = append
+    return fitted
+
+
+def interrupt(gp, test, genes):
+    # run the test until it is interrupted after the first genes
+    fit_single_gene = gp.fit_single_gene
+    calls = []
+
+    def interrupted(*args):
+        calls.append(args)
+        if len(calls) > genes:
+            raise KeyboardInterrupt
+        return fit_single_gene(*args)
+
+    gp.fit_single_gene = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        test()
+    del gp.fit_single_gene
+
+
+def test_resumed_run_matches_uninterrupted_run(data):
+    X, Y = data
+    baseline = fit_gpcounts(X, Y, save_models=None).One_sample_test()
+
+    gp = fit_gpcounts(X, Y, save_models=None)
+    gp.journal = 'journal.csv'
+    interrupt(gp, gp.One_sample_test, genes=2)
+    with open('journal.csv', 'a') as f:
+        f.write('gene_3,-1.5')  # row cut by the interruption
+    fitted = count_fits(gp)
+    resumed = gp.One_sample_test()
+    assert sorted(set(fitted)) == ['gene_3', 'gene_4']
+    pd.testing.assert_frame_equal(resumed, baseline)
+
+
+def test_journal_of_another_likelihood_is_not_resumed(data):
+    X, Y = data
+    gp = fit_gpcounts(X, Y.iloc[0:2], save_models=None)
+    gp.journal = 'journal.csv'
+    gp.One_sample_test('Negative_binomial')
+    gaussian = gp.One_sample_test('Gaussian')
+    baseline = fit_gpcounts(X, Y.iloc[0:2], save_models=None).One_sample_test('Gaussian')
+    pd.testing.assert_frame_equal(gaussian, baseline)
+
+
+def test_journal_of_other_counts_is_not_resumed(data):
+    X, Y = data
+    gp = fit_gpcounts(X, Y.iloc[0:2], save_models=None)
+    gp.journal = 'journal.csv'
+    gp.Infer_trajectory('Gaussian')
+    other = fit_gpcounts(X, Y.iloc[0:2] + 1, save_models=None)
+    other.journal = 'journal.csv'
+    fitted = count_fits(other)
+    other.Infer_trajectory('Gaussian')
+    assert sorted(set(fitted)) == ['gene_1', 'gene_2']
+
+
+def test_parallel_run_journals_every_gene_once(data):
+    X, Y = data
+    baseline = fit_gpcounts(X, Y, save_models=None).Infer_trajectory('Gaussian')
+    gp = fit_gpcounts(X, Y, save_models=None)
+    gp.journal = 'journal.csv'
+    interrupt(gp, lambda: gp.Infer_trajectory('Gaussian'), genes=1)
+    parallel = gp.Infer_trajectory('Gaussian', n_jobs=2)
+    pd.testing.assert_frame_equal(parallel, baseline)
+    journal = pd.read_csv('journal.csv', skiprows=1, index_col=0)
+    assert sorted(journal.index) == sorted(Y.index)
+
+
+def test_resumed_run_loads_the_models_of_every_gene(data):
+    X, Y = data
+    gp = fit_gpcounts(X, Y, save_models='store')
+    gp.journal = 'journal.csv'
+    interrupt(gp, lambda: gp.One_sample_test('Gaussian'), genes=2)
+
+    resumed = fit_gpcounts(X, Y, save_models='store')
+    resumed.journal = 'journal.csv'
+    fitted = count_fits(resumed)
+    resumed.One_sample_test('Gaussian')
+    assert sorted(set(fitted)) == ['gene_3', 'gene_4']
+    models = resumed.load_predict_models(list(Y.index), 'One_sample_test', 'Gaussian', predict=False)['models']
+    assert all(isinstance(model, gpflow.models.GPR) for gene_models in models for model in gene_models)
+    assert glob.glob(resumed.get_store_name() + '.part_*') == []
@@ -0,0 +1,36 @@
+import gpflow
+import numpy as np
+from GPcounts import kernelCache
+from conftest import fit_gpcounts
+
+
+def test_default_models_are_gpflow_models(data):
+    X, Y = data
+    gp = fit_gpcounts(X, Y.iloc[0:1])
+    gp.Infer_trajectory('Gaussian')
+    assert type(gp.model) is gpflow.models.GPR
+    gp.Infer_trajectory('Negative_binomial')
+    assert type(gp.model) is gpflow.models.VGP
+
+
+def test_fixed_branching_kernel_hits_the_cache(data):
+    # the kernel is fixed only while branching times are scanned, the only fits that read the cache
+    X, Y = data
+    labels = np.tile([1., 2.], X.shape[0] // 2)
+    baseline = fit_gpcounts(X, Y.iloc[0:1]).Infer_branching_location(labels, bins_num=3, lik_name='Gaussian')
+    gp = fit_gpcounts(X, Y.iloc[0:1])
+    gp.kernel_cache = kernelCache.KernelCache()
+    cached = gp.Infer_branching_location(labels, bins_num=3, lik_name='Gaussian')
+    assert gp.kernel_cache.hits > 0
+    np.testing.assert_allclose(cached['loglik'], baseline['loglik'], rtol=1e-6)
+    assert cached['branching_location'] == baseline['branching_location']
+
+
+def test_restored_models_are_gpflow_models(data):
+    X, Y = data
+    gp = fit_gpcounts(X, Y.iloc[0:1])
+    gp.kernel_cache = kernelCache.KernelCache()
+    gp.Infer_trajectory('Gaussian')
+    models = gp.load_predict_models(['gene_1'], 'Infer_trajectory', 'Gaussian', predict=False)['models']
+    assert type(models[0][0]) is gpflow.models.GPR
+    assert np.isfinite(models[0][0].log_posterior_density().numpy())
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+from GPcounts import NegativeBinomialLikelihood
+
+
+@pytest.mark.parametrize('likelihood', ['NegativeBinomial', 'ZeroInflatedNegativeBinomial'])
+def test_zero_split_matches_log_probabilities(likelihood):
+    rng = np.random.default_rng(0)
+    F = rng.normal(1., 1., (50, 1))
+    Y = rng.negative_binomial(2., .4, (50, 1)).astype(float)
+    Fvar = rng.uniform(.1, 1., (50, 1))
+    assert np.any(Y == 0) and np.any(Y > 0)
+    split = getattr(NegativeBinomialLikelihood, likelihood)(alpha=.5, zero_split=True)
+    dense = getattr(NegativeBinomialLikelihood, likelihood)(alpha=.5)
+    np.testing.assert_allclose(split.log_prob(F, Y).numpy(), dense.log_prob(F, Y).numpy(), rtol=1e-12)
+    np.testing.assert_allclose(split.variational_expectations(F, Fvar, Y).numpy(),
+                               dense.variational_expectations(F, Fvar, Y).numpy(), rtol=1e-12)
@@ -0,0 +1,20 @@
+import numpy as np
+from conftest import simulate_counts, fit_gpcounts
+
+
+def test_minibatch_fit_matches_full_data_fit():
+    X, Y = simulate_counts(genes=2, cells=120)
+    gp = fit_gpcounts(X, Y, sparse=True, save_models=None)
+    gp.max_inducing_points = 6
+    full = gp.Infer_trajectory('Negative_binomial')
+
+    gp.minibatch_size = 32
+    gp.minibatch_options = dict(gp.minibatch_options, maxiter=3000, learning_rate=0.05, window=50)
+    minibatch = gp.Infer_trajectory('Negative_binomial')
+    assert np.isfinite(minibatch.values).all()
+    np.testing.assert_allclose(minibatch.values, full.values, rtol=0.05)
+
+    # one compiled update is reused by every gene
+    (model,) = gp.minibatch_models.values()
+    assert model.fits == 2
+    assert model.step.experimental_get_tracing_count() <= 2
@@ -0,0 +1,34 @@
+import os
+import numpy as np
+from conftest import fit_gpcounts
+
+
+def test_store_holds_every_model_in_one_file(data):
+    X, Y = data
+    gp = fit_gpcounts(X, Y.iloc[0:2], save_models='store')
+    gp.One_sample_test('Gaussian')
+    assert os.listdir(os.path.dirname(gp.get_store_name())) == [os.path.basename(gp.get_store_name())]
+    assert len(gp.model_store.load().models) == 4
+
+
+def test_stored_models_predict_as_checkpoints(data):
+    X, Y = data
+    genes = list(Y.index[0:2])
+    predictions = {}
+    for save_models in ['checkpoint', 'store']:
+        gp = fit_gpcounts(X, Y.iloc[0:2], save_models=save_models)
+        gp.One_sample_test('Gaussian')
+        predictions[save_models] = gp.load_predict_models(genes, 'One_sample_test', 'Gaussian')
+    np.testing.assert_allclose(np.array(predictions['store']['means']), np.array(predictions['checkpoint']['means']),
+                               rtol=1e-6)
+    np.testing.assert_allclose(np.array(predictions['store']['vars']), np.array(predictions['checkpoint']['vars']),
+                               rtol=1e-6)
+
+
+def test_load_predict_models_follows_progress_bar(data, capsys):
+    X, Y = data
+    gp = fit_gpcounts(X, Y.iloc[0:1], save_models='store')
+    gp.One_sample_test('Gaussian')
+    capsys.readouterr()
+    gp.load_predict_models(list(Y.index[0:1]), 'One_sample_test', 'Gaussian')
+    assert capsys.readouterr().err == ''
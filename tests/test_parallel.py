@@ -0,0 +1,8 @@
+import pandas as pd
+from conftest import fit_gpcounts
+
+
+def test_parallel_test_matches_serial_test(data, one_sample_baseline):
+    X, Y = data
+    parallel = fit_gpcounts(X, Y).One_sample_test('Negative_binomial', n_jobs=2)
+    pd.testing.assert_frame_equal(parallel, one_sample_baseline)
@@ -0,0 +1,16 @@
+import numpy as np
+from conftest import fit_gpcounts
+
+
+def test_posterior_predictive_samples_match_predictive_mean(data):
+    X, Y = data
+    gp = fit_gpcounts(X, Y.iloc[0:1])
+    gp.Infer_trajectory('Negative_binomial')
+    xtest = np.linspace(0., 1., 20)[:, None]
+    mean, samples = gp.samples_posterior_predictive_distribution(xtest)
+    assert samples.shape == (gp.f_samples_number // 5 * gp.y_samples_number, len(xtest))
+    # E[y] = E[exp(f)] = exp(mu+var/2) of the latent GP
+    mu, var = gp.model.predict_f(xtest)
+    np.testing.assert_allclose(np.mean(samples, axis=0), np.exp(mu.numpy() + var.numpy() / 2.).ravel(), rtol=.1)
+    np.testing.assert_allclose(mean[2:-2], np.mean(samples, axis=0)[2:-2], rtol=.1)
+    np.testing.assert_array_equal(gp.samples_posterior_predictive_distribution(xtest)[1], samples)
@@ -0,0 +1,25 @@
+import numpy as np
+from conftest import fit_gpcounts
+
+
+def test_profile_records_every_model(data):
+    X, Y = data
+    events = []
+    gp = fit_gpcounts(X, Y.iloc[0:2], save_models=None)
+    gp.profile = True
+    gp.profile_hooks.append(lambda event, record: events.append((event, record['gene'], record['model_index'])))
+    results = gp.One_sample_test('Gaussian')
+    report = gp.profile_report()
+    assert list(zip(report['gene'], report['model_index'])) == [(gene, i) for gene in Y.index[0:2] for i in [1, 2]]
+    assert (report['fit_time'] >= report['optimize_time']).all() and (report['nit'] > 0).all()
+    assert events == [(event, gene, i) for gene in Y.index[0:2] for i in [1, 2] for event in ['start', 'end']]
+    # the log likelihood ratio of every gene is the difference of the log likelihoods of its two models
+    ratios = report['log_likelihood'].values.reshape([-1, 2])
+    np.testing.assert_allclose(results['log_likelihood_ratio'].values, ratios[:, 0] - ratios[:, 1], atol=1e-6)
+
+
+def test_profile_is_off_by_default(data):
+    X, Y = data
+    gp = fit_gpcounts(X, Y.iloc[0:1], save_models=None)
+    gp.One_sample_test('Gaussian')
+    assert gp.profile_report().empty
@@ -0,0 +1,14 @@
+import pandas as pd
+from conftest import fit_gpcounts
+
+
+def test_samples_follow_sparse_and_inducing_points_settings(data):
+    X, Y = data
+    gp = fit_gpcounts(X, Y.iloc[0:2], save_models=None)
+    gp.Two_samples_test('Gaussian')
+    gp.sparse = True
+    gp.max_inducing_points = 1
+    sparse = fit_gpcounts(X, Y.iloc[0:2], sparse=True, save_models=None)
+    sparse.max_inducing_points = 1
+    pd.testing.assert_frame_equal(gp.Two_samples_test('Gaussian'), sparse.Two_samples_test('Gaussian'))
+    assert all(sample['Z'] is not None for sample in gp.samples)
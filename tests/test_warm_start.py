@@ -0,0 +1,42 @@
+from collections import deque
+import numpy as np
+import pandas as pd
+import pytest
+from GPcounts import geneFit
+from conftest import fit_gpcounts
+
+
+@pytest.mark.parametrize('warm_start', ['nearest', 'median'])
+def test_warm_start_records_only_valid_fits(data, warm_start):
+    X, Y = data
+    gp = fit_gpcounts(X, Y, warm_start=warm_start)
+    results = gp.One_sample_test('Negative_binomial')
+    assert (results[['Dynamic_model_log_likelihood', 'Constant_model_log_likelihood']].values <= 0).all()
+    for records in gp.fitted_hyper_parameters.values():
+        for _, params in records:
+            assert all(np.isfinite(value) and value >= geneFit.Minimum_hyper_parameter for value in params.values())
+
+
+def test_degenerate_warm_start_is_clamped(data):
+    X, Y = data
+    gp = fit_gpcounts(X, Y, warm_start='nearest')
+    gp.lik_name = 'Negative_binomial'
+    x = gp.X
+    y = gp.gene_counts(3).reshape([-1, 1])
+    gp.fitted_hyper_parameters[1] = deque([(gp.gene_features(y), {'var': 4e-13, 'ls': 1e3, 'alpha': 3e-15})])
+    init = gp.init_hyper_parameters(1, x, y)
+    warm = gp.warm_start_hyper_parameters(init, 1, x, y)
+    low, high = geneFit.hyper_parameters_ranges(x)['ls']
+    assert warm['var'] >= geneFit.Minimum_hyper_parameter
+    assert warm['alpha'] >= geneFit.Minimum_hyper_parameter
+    assert low <= warm['ls'] <= high
+    assert warm['km'] == init['km']
+
+
+def test_parallel_warm_start_does_not_depend_on_the_shards(data):
+    X, Y = data
+    cold = fit_gpcounts(X, Y).Infer_trajectory('Negative_binomial')
+    gp = fit_gpcounts(X, Y, warm_start='nearest')
+    parallel = gp.Infer_trajectory('Negative_binomial', n_jobs=2)
+    pd.testing.assert_frame_equal(parallel, cold)
+    assert gp.warm_start == 'nearest'